@@ -1,6 +1,15 @@
 from PIL import Image, ImageDraw
+from collections import OrderedDict
+from types import SimpleNamespace
+import hashlib
+import logging
 import math
+import threading
+import numpy as np
 from circuit_scheme import *
+from animation_writer import save_animation
+import render_stats
+from svg_backend import SvgDraw, frame_visibility
 from typing import List
 
 
@@ -12,6 +21,10 @@ resistor_width = 200
 contact_size = 50
 resistor_outline_width = 10 * image_resize_factor
 wire_outline_width = 6 * image_resize_factor
+# 'P' draws straight into circuit_scheme.palette, 'RGB' gives true colour frames that have to be quantized for GIF
+frame_mode = 'P'
+# colors the stage timelines draw with, 'P' frames get those missing from circuit_scheme.palette up front
+frame_colors = []
 
 
 def c_x(x):
@@ -22,27 +35,56 @@ def c_y(y):
     return image_resize_factor * (y + image_height/2)
 
 
-def create_empty_frame():
-    return Image.new('RGB', (int(image_width * image_resize_factor), int(image_height * image_resize_factor)),
-                     (255, 255, 255))
+def create_empty_frame(quality=full_quality):
+    return create_image(quality.size((int(image_width * image_resize_factor), int(image_height * image_resize_factor))),
+                        frame_mode, frame_colors)
+
+
+def _scaled(coords, quality):
+    # full quality frame coordinates to those of a draft frame
+    return (np.asarray(coords) * quality.scale).tolist()
+
+
+def _joint(quality):
+    return 'curve' if quality.curved_joints else None
+
+
+def raster_resistor_box(draw, box, color=(0, 0, 0)):
+    draw.rectangle(box, outline=color, width=resistor_outline_width)
+
+
+def raster_resistor_outline(draw, points, color=(0, 0, 0)):
+    draw.line(points, width=resistor_outline_width, fill=color, joint='curve')
+
+
+def raster_wire(draw, points, color=(0, 0, 0)):
+    draw.line(points, width=wire_outline_width, fill=color, joint='curve')
+
+
+def raster_contact(draw, box, line, color=(0, 0, 0)):
+    draw.ellipse(box, fill=(255, 255, 255), outline=color, width=resistor_outline_width)
+    draw.line(line, width=wire_outline_width, fill=color)
+
+
+resistor_corners = [(-resistor_length/2, -resistor_width/2),
+                    (-resistor_length/2, +resistor_width/2),
+                    (+resistor_length/2, +resistor_width/2),
+                    (+resistor_length/2, -resistor_width/2),
+                    (-resistor_length/2, -resistor_width/2),
+                    (-resistor_length/2, +resistor_width/2)]
 
 
 def draw_resistor(draw, x_center, y_center, color=(0, 0, 0), angle=0.0):
     if angle == 0.0:
-        draw.rectangle(
+        raster_resistor_box(
+            draw,
             [c_x(x_center - resistor_length / 2), c_y(y_center - resistor_width / 2),
              c_x(x_center + resistor_length / 2), c_y(y_center + resistor_width / 2)],
-            outline=color, width=resistor_outline_width)
+            color)
     else:
-        points = [(-resistor_length/2, -resistor_width/2),
-                  (-resistor_length/2, +resistor_width/2),
-                  (+resistor_length/2, +resistor_width/2),
-                  (+resistor_length/2, -resistor_width/2),
-                  (-resistor_length/2, -resistor_width/2),
-                  (-resistor_length/2, +resistor_width/2)]
         points = [(c_x(x_center + p[0]*math.cos(angle)-p[1]*math.sin(angle)),
-                   c_y(y_center + p[0]*math.sin(angle)+p[1]*math.cos(angle))) for p in points]
-        draw.line(points, width=resistor_outline_width, fill=color, joint='curve')
+                   c_y(y_center + p[0]*math.sin(angle)+p[1]*math.cos(angle))) for p in resistor_corners]
+        raster_resistor_outline(draw, points, color)
 
 
 def draw_wire(draw, xy, color=(0, 0, 0)):
@@ -54,194 +96,724 @@ def draw_wire(draw, xy, color=(0, 0, 0)):
         xy_new = [(xy[i], xy[i+1]) for i in range(0, len(xy), 2)]
     xy_new = [(c_x(elem[0]), c_y(elem[1])) for elem in xy_new]
 
-    draw.line(xy_new, width=wire_outline_width, fill=color, joint='curve')
+    raster_wire(draw, xy_new, color)
 
 
 def draw_contact(draw, x_center, y_center, color=(0, 0, 0)):
-    draw.ellipse(
+    raster_contact(
+        draw,
         [c_x(x_center - contact_size / 2), c_y(y_center - contact_size / 2),
          c_x(x_center + contact_size / 2), c_y(y_center + contact_size / 2)],
-        fill=(255, 255, 255), outline=color, width=resistor_outline_width)
-    draw.line([c_x(x_center - contact_size / 2), c_y(y_center + contact_size / 2),
-               c_x(x_center + contact_size / 2), c_y(y_center - contact_size / 2)],
-              width=wire_outline_width, fill=color)
-
-
-def create_frame_stage_1(step, max_steps):
-    img = create_empty_frame()
-    draw = ImageDraw.Draw(img)
-
-    draw_resistor(draw, 0, 0)
-    draw_resistor(draw, -900, 0)
-    draw_resistor(draw, +900, 0)
-
-    draw_wire(draw, [+250, 0, +650, 0])
-    draw_wire(draw, [-250, 0, -650, 0])
-    draw_wire(draw, [-450, 0, -450, +900, +1350, +900, +1350, 0, +1150, 0])
-    draw_wire(draw, [+450, 0, +450, -900, -1350, -900, -1350, 0, -1150, 0])
-
-    turn_step = int(max_steps * 18.0 / 31.0)
-    if step <= turn_step:
-        draw_wire(draw, [+1550, +1100 * step / turn_step, +1350, +900 * step / turn_step])
-        draw_wire(draw, [-1550, -1100 * step / turn_step, -1350, -900 * step / turn_step])
-        draw_contact(draw, +1550, +1100 * step / turn_step)
-        draw_contact(draw, -1550, -1100 * step / turn_step)
-    else:
-        draw_wire(draw, [+1550 - 1550 * (step-turn_step) / (max_steps - 1 - turn_step), +1150,
-                         +1350 - 1350 * (step-turn_step) / (max_steps - 1 - turn_step), +900])
-        draw_wire(draw, [-1550 + 1550 * (step-turn_step) / (max_steps - 1 - turn_step), -1150,
-                         -1350 + 1350 * (step-turn_step) / (max_steps - 1 - turn_step), -900])
-        draw_contact(draw, +1550 - 1550 * (step-turn_step) / (max_steps - 1 - turn_step), +1150)
-        draw_contact(draw, -1550 + 1550 * (step-turn_step) / (max_steps - 1 - turn_step), -1150)
-
-    return img
-
-
-def create_frame_stage_2(step, max_steps):
-    img = create_empty_frame()
-    draw = ImageDraw.Draw(img)
-
-    draw_resistor(draw, 0, 0)
-
-    draw_wire(draw, [+250, 0, +450, 0])
-    draw_wire(draw, [-250, 0, -450, 0])
-    draw_wire(draw, [-450, 0, -450, +900, 0, +900])
-    draw_wire(draw, [+450, 0, +450, -900, 0, -900])
-    draw_wire(draw, [0, +1150, 0, +900])
-    draw_wire(draw, [0, -1150, 0, -900])
-
-    draw_contact(draw, 0, +1150)
-    draw_contact(draw, 0, -1150)
-
-    turn_step = int(max_steps * 2.0 / 3.0)
-    if step <= turn_step:
-        phi = math.atan2(step, turn_step)
-        draw_wire(draw, [+450, 0, +900 - resistor_length / 2 * math.cos(phi),
-                         +450 * math.tan(phi) - resistor_length / 2 * math.sin(phi)])
-        draw_wire(draw, [-450, 0, -900 + resistor_length / 2 * math.cos(phi),
-                         -450 * math.tan(phi) + resistor_length / 2 * math.sin(phi)])
-        draw_wire(draw, [0, +900, +1350, +900, +1350, +900 * math.tan(phi),
-                         +900 + resistor_length / 2 * math.cos(phi),
-                         +450 * math.tan(phi) + resistor_length / 2 * math.sin(phi)])
-        draw_wire(draw, [0, -900, -1350, -900, -1350, -900 * math.tan(phi),
-                         -900 - resistor_length / 2 * math.cos(phi),
-                         -450 * math.tan(phi) - resistor_length / 2 * math.sin(phi)])
-        draw_resistor(draw, +900, +450 * math.tan(phi), angle=phi)
-        draw_resistor(draw, -900, -450 * math.tan(phi), angle=phi)
-    else:
-        phi = math.atan2(max_steps - 1 - step, max_steps - 1 - turn_step)
-        draw_wire(draw, [+450, 0, +900 - 450 * math.sin(phi), 0,
-                         +900 - resistor_length / 2 * math.sin(phi), +450 - resistor_length / 2 * math.cos(phi)])
-        draw_wire(draw, [-450, 0, -900 + 450 * math.sin(phi), 0,
-                         -900 + resistor_length / 2 * math.sin(phi), -450 + resistor_length / 2 * math.cos(phi)])
-        draw_wire(draw, [0, +900, +900 + 450 * math.tan(phi), +900,
-                         +900 + resistor_length / 2 * math.sin(phi), +450 + resistor_length / 2 * math.cos(phi)])
-        draw_wire(draw, [0, -900, -900 - 450 * math.tan(phi), -900,
-                         -900 - resistor_length / 2 * math.sin(phi), -450 - resistor_length / 2 * math.cos(phi)])
-        draw_resistor(draw, +900, +450, angle=math.pi / 2 - phi)
-        draw_resistor(draw, -900, -450, angle=math.pi / 2 - phi)
-
-    return img
-
-
-def create_frame_stage_3(step, max_steps):
-    img = create_empty_frame()
-    draw = ImageDraw.Draw(img)
-
-    draw_resistor(draw, 0, 0)
-    draw_resistor(draw, +900, +450, angle=math.pi / 2)
-    draw_resistor(draw, -900, -450, angle=math.pi / 2)
-
-    draw_wire(draw, [+250, 0, +900, 0, +900, +200])
-    draw_wire(draw, [-250, 0, -900, 0, -900, -200])
-    draw_wire(draw, [0, +1150, 0, +900])
-    draw_wire(draw, [0, -1150, 0, -900])
-    draw_wire(draw, [0, +900, +900, +900, +900, +700])
-    draw_wire(draw, [0, -900, -900, -900, -900, -700])
-
-    draw_contact(draw, 0, +1150)
-    draw_contact(draw, 0, -1150)
-
-    draw_wire(draw, [-450 - 450 * step / (max_steps - 1), 0, -450 - 450 * step / (max_steps - 1), +900, 0, +900])
-    draw_wire(draw, [+450 + 450 * step / (max_steps - 1), 0, +450 + 450 * step / (max_steps - 1), -900, 0, -900])
-
-    return img
-
-
-def create_frame_stage_4(step, max_steps):
-    img = create_empty_frame()
-    draw = ImageDraw.Draw(img)
-
-    draw_resistor(draw, +900, +450, angle=math.pi / 2)
-    draw_resistor(draw, -900, -450, angle=math.pi / 2)
-
-    draw_wire(draw, [0, +1150, 0, +900])
-    draw_wire(draw, [0, -1150, 0, -900])
-    draw_wire(draw, [0, +900, +900, +900, +900, +700])
-    draw_wire(draw, [0, -900, -900, -900, -900, -700])
-    draw_wire(draw, [-900, -200, -900, +900, 0, +900])
-    draw_wire(draw, [+900, +200, +900, -900, 0, -900])
-
-    draw_contact(draw, 0, +1150)
-    draw_contact(draw, 0, -1150)
-
-    turn_step = int(max_steps * 0.5)
-    if step <= turn_step:
-        phi = -math.atan2(900 * step / turn_step, 900)
-        draw_resistor(draw, 0, 0, angle=phi)
-        draw_wire(draw, [+resistor_length / 2 * math.cos(phi), +resistor_length / 2 * math.sin(phi),
-                         +900, +900 * math.tan(phi)])
-        draw_wire(draw, [-resistor_length / 2 * math.cos(phi), -resistor_length / 2 * math.sin(phi),
-                         -900, -900 * math.tan(phi)])
-    else:
-        phi = math.atan2(max_steps - 1 - step, max_steps - 1 - turn_step)
-        draw_resistor(draw, 0, 0, angle=phi - math.pi / 2)
-        draw_wire(draw, [+resistor_length / 2 * math.sin(phi), -resistor_length / 2 * math.cos(phi),
-                         +900 * math.tan(phi), -900])
-        draw_wire(draw, [-resistor_length / 2 * math.sin(phi), +resistor_length / 2 * math.cos(phi),
-                         -900 * math.tan(phi), +900])
-
-    return img
-
-
-def create_frame_stage_5(step, max_step):
-    img = create_empty_frame()
-    draw = ImageDraw.Draw(img)
-
-    draw_resistor(draw, 0, 0, angle=math.pi / 2)
-
-    draw_wire(draw, [0, +1150, 0, +resistor_length / 2])
-    draw_wire(draw, [0, -1150, 0, -resistor_length / 2])
-
-    draw_contact(draw, 0, +1150)
-    draw_contact(draw, 0, -1150)
-
-    draw_resistor(draw, +900, +450 - 450 * step / (max_step - 1), angle=math.pi / 2)
-    draw_resistor(draw, -900, -450 + 450 * step / (max_step - 1), angle=math.pi / 2)
-
-    draw_wire(draw, [0, +900, +900, +900, +900, +700 - (700 - resistor_length / 2) * step / (max_step - 1)])
-    draw_wire(draw, [0, -900, -900, -900, -900, -700 + (700 - resistor_length / 2) * step / (max_step - 1)])
-    draw_wire(draw, [-900, -200 + (200 + resistor_length / 2) * step / (max_step - 1), -900, +900, 0, +900])
-    draw_wire(draw, [+900, +200 - (200 + resistor_length / 2) * step / (max_step - 1), +900, -900, 0, -900])
-
-    return img
-
-
-def demo():
-    frames = []
-    for n_frame in range(30):
-        frames.append(create_frame_stage_1(n_frame, 30))
-    for n_frame in range(30):
-        frames.append(create_frame_stage_2(n_frame, 30))
-    for n_frame in range(15):
-        frames.append(create_frame_stage_3(n_frame, 15))
-    for n_frame in range(30):
-        frames.append(create_frame_stage_4(n_frame, 30))
-    for n_frame in range(10):
-        frames.append(create_frame_stage_5(n_frame, 10))
-
-    frames[0].save('scheme_transformation.gif', format='GIF', append_images=frames[1:], save_all=True,
-                   duration=20, loop=1)
+        [c_x(x_center - contact_size / 2), c_y(y_center + contact_size / 2),
+         c_x(x_center + contact_size / 2), c_y(y_center - contact_size / 2)],
+        color)
+
+
+_static_layers = {}
+
+
+def static_layer(draw_static, quality=full_quality):
+    # rendered once per stage, frame size and quality
+    key = (draw_static, int(image_width * image_resize_factor), int(image_height * image_resize_factor), frame_mode,
+           quality)
+    if key not in _static_layers:
+        img = create_empty_frame(quality)
+        if quality == full_quality:
+            draw_static(ImageDraw.Draw(img))
+        else:
+            draw_static(ImageDraw.Draw(img), quality)
+        _static_layers[key] = img
+    return _static_layers[key]
+
+
+def compose_frame(static, draw_dynamic, dirty_bbox, layer_key):
+    # only the moving parts are rasterized, on top of a copy of the static layer
+    # the frame records the pixel bounding box of those parts and a key of the static layer, so consumers can limit
+    # comparisons of frames with the same key to their boxes
+    frame = static.copy()
+    if dirty_bbox is not None:
+        draw_dynamic(ImageDraw.Draw(frame))
+    frame.info['static_layer'] = layer_key
+    frame.info['dirty_bbox'] = dirty_bbox
+    return frame
+
+
+# Timeline of a stage: primitives whose coordinates are tracks, i.e. constants or functions of the frame variables.
+# A track gets a namespace with numpy arrays 'step' (steps of all frames of a phase) and 'progress'
+# (step / (max_steps - 1)), the int 'max_steps' and whatever the phase adds in 'variables', and returns the values
+# for all those frames at once.
+
+def _libm(fn, nin=1):
+    # numpy trig can differ from libm in the last ulp, which moves pixels, so angles go through the math functions
+    ufunc = np.frompyfunc(fn, nin, 1)
+    return lambda *args: np.asarray(ufunc(*args), dtype=float)
+
+
+_sin = _libm(math.sin)
+_cos = _libm(math.cos)
+_tan = _libm(math.tan)
+_atan2 = _libm(math.atan2, 2)
+
+
+def _evaluate(track, v):
+    if callable(track):
+        return np.broadcast_to(np.asarray(track(v), dtype=float), v.step.shape)
+    return np.full(v.step.shape, float(track))
+
+
+class AnimatedResistor:
+    def __init__(self, x, y, angle=0.0, color=(0, 0, 0)):
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.color = color
+
+    def compile(self, v):
+        x = _evaluate(self.x, v)
+        y = _evaluate(self.y, v)
+        angle = _evaluate(self.angle, v)
+        box = np.stack([c_x(x - resistor_length / 2), c_y(y - resistor_width / 2),
+                        c_x(x + resistor_length / 2), c_y(y + resistor_width / 2)], axis=-1)
+        cos = _cos(angle)[:, np.newaxis]
+        sin = _sin(angle)[:, np.newaxis]
+        corners = np.array(resistor_corners)
+        outline = np.stack([c_x(x[:, np.newaxis] + corners[:, 0] * cos - corners[:, 1] * sin),
+                            c_y(y[:, np.newaxis] + corners[:, 0] * sin + corners[:, 1] * cos)], axis=-1)
+        return _CompiledResistor(angle, box, outline, self.color)
+
+
+class AnimatedWire:
+    def __init__(self, *xy, color=(0, 0, 0)):
+        self.xy = xy
+        self.color = color
+
+    def compile(self, v):
+        points = np.stack([np.stack([c_x(_evaluate(self.xy[i], v)), c_y(_evaluate(self.xy[i + 1], v))], axis=-1)
+                           for i in range(0, len(self.xy), 2)], axis=1)
+        return _CompiledWire(points, self.color)
+
+
+class AnimatedContact:
+    def __init__(self, x, y, color=(0, 0, 0)):
+        self.x = x
+        self.y = y
+        self.color = color
+
+    def compile(self, v):
+        x = _evaluate(self.x, v)
+        y = _evaluate(self.y, v)
+        box = np.stack([c_x(x - contact_size / 2), c_y(y - contact_size / 2),
+                        c_x(x + contact_size / 2), c_y(y + contact_size / 2)], axis=-1)
+        line = np.stack([c_x(x - contact_size / 2), c_y(y + contact_size / 2),
+                         c_x(x + contact_size / 2), c_y(y - contact_size / 2)], axis=-1)
+        return _CompiledContact(box, line, self.color)
+
+
+class _CompiledResistor:
+    def __init__(self, angle, box, outline, color):
+        self.angle = angle
+        self.straight = angle == 0.0
+        self.box = box
+        self.outline = outline
+        self.color = color
+
+    def points(self):
+        return np.concatenate([self.box.reshape(len(self.box), -1, 2), self.outline], axis=1)
+
+    def raster(self, draw, idx, quality=full_quality):
+        if quality != full_quality:
+            self._draft(draw, idx, quality)
+        elif self.straight[idx]:
+            raster_resistor_box(draw, self.box[idx].tolist(), self.color)
+        else:
+            raster_resistor_outline(draw, [tuple(p) for p in self.outline[idx].tolist()], self.color)
+
+    def _draft(self, draw, idx, quality):
+        if resistor_length * image_resize_factor * quality.scale < quality.min_symbol_pixels:
+            return
+        width = quality.width(resistor_outline_width)
+        if self.straight[idx]:
+            draw.rectangle(_scaled(self.box[idx], quality), outline=self.color, width=width)
+        else:
+            draw.line([tuple(p) for p in _scaled(self.outline[idx], quality)], width=width, fill=self.color,
+                      joint=_joint(quality))
+
+    def vector(self, draw, idx):
+        x0, y0, x1, y1 = self.box[idx].tolist()
+        draw.use('resistor', (x0 + x1) / 2, (y0 + y1) / 2, math.degrees(self.angle[idx]), self.color)
+
+
+class _CompiledWire:
+    def __init__(self, points, color):
+        self._points = points
+        self.color = color
+
+    def points(self):
+        return self._points
+
+    def raster(self, draw, idx, quality=full_quality):
+        if quality != full_quality:
+            draw.line([tuple(p) for p in _scaled(self._points[idx], quality)],
+                      width=quality.width(wire_outline_width), fill=self.color, joint=_joint(quality))
+            return
+        raster_wire(draw, [tuple(p) for p in self._points[idx].tolist()], self.color)
+
+    def vector(self, draw, idx):
+        self.raster(draw, idx)
+
+
+class _CompiledContact:
+    def __init__(self, box, line, color):
+        self.box = box
+        self.line = line
+        self.color = color
+
+    def points(self):
+        return np.concatenate([self.box.reshape(len(self.box), -1, 2), self.line.reshape(len(self.line), -1, 2)],
+                              axis=1)
+
+    def raster(self, draw, idx, quality=full_quality):
+        if quality != full_quality:
+            self._draft(draw, idx, quality)
+            return
+        raster_contact(draw, self.box[idx].tolist(), self.line[idx].tolist(), self.color)
+
+    def _draft(self, draw, idx, quality):
+        if contact_size * image_resize_factor * quality.scale < quality.min_symbol_pixels:
+            return
+        box = _scaled(self.box[idx], quality)
+        if quality.contact_boxes:
+            draw.rectangle(box, outline=self.color, width=quality.width(resistor_outline_width))
+            return
+        draw.ellipse(box, fill=(255, 255, 255), outline=self.color, width=quality.width(resistor_outline_width))
+        draw.line(_scaled(self.line[idx], quality), width=quality.width(wire_outline_width), fill=self.color)
+
+    def vector(self, draw, idx):
+        x0, y0, x1, y1 = self.box[idx].tolist()
+        draw.use('contact', (x0 + x1) / 2, (y0 + y1) / 2, 0.0, self.color)
+
+
+class Phase:
+    # until: last step of the phase as a function of max_steps, None for the rest of the stage
+    # variables: extra frame variables shared by the tracks of the phase
+    def __init__(self, primitives, until=None, variables=None):
+        self.primitives = primitives
+        self.until = until
+        self.variables = variables
+
+
+def _frame_variables(steps, max_steps, variables):
+    v = SimpleNamespace(step=steps.astype(float), max_steps=max_steps)
+    v.progress = v.step / (max_steps - 1) if max_steps > 1 else np.zeros_like(v.step)
+    if variables is not None:
+        for name, value in variables(v).items():
+            setattr(v, name, value)
+    return v
+
+
+class StageTimeline:
+    # static primitives are drawn once into the stage's static layer, phases are drawn on top of it in order
+    def __init__(self, static, phases, name='stage'):
+        self.static = static
+        self.phases = phases
+        self.name = name
+        self._compiled = {}
+
+    def compile(self, max_steps):
+        key = (max_steps, image_resize_factor, image_width, image_height)
+        if key not in self._compiled:
+            self._compiled[key] = CompiledStage(self, max_steps)
+        return self._compiled[key]
+
+    def frame(self, step, max_steps, quality=full_quality):
+        # every quality draws from the same compiled geometry
+        return self.compile(max_steps).frame(step, quality)
+
+
+class CompiledStage:
+    # every vertex of every frame, evaluated for all frames of a phase at once
+    def __init__(self, timeline, max_steps):
+        self.max_steps = max_steps
+        self.name = timeline.name
+        v = _frame_variables(np.zeros(1, dtype=int), max_steps, None)
+        self.static = [primitive.compile(v) for primitive in timeline.static]
+        self.static_key = (self.name, _static_fingerprint(self.static))
+
+        # phase index and index within the phase of every step
+        self.phase_of_step = np.zeros(max_steps, dtype=int)
+        self.index_in_phase = np.zeros(max_steps, dtype=int)
+        self.phases = []
+        first = 0
+        for phase_idx, phase in enumerate(timeline.phases):
+            last = max_steps - 1 if phase.until is None else min(phase.until(max_steps), max_steps - 1)
+            steps = np.arange(first, last + 1)
+            v = _frame_variables(steps, max_steps, phase.variables)
+            compiled = [primitive.compile(v) for primitive in phase.primitives]
+            self.phases.append((compiled, _dirty_boxes(compiled, len(steps))))
+            self.phase_of_step[first:last + 1] = phase_idx
+            self.index_in_phase[first:last + 1] = steps - first
+            first = last + 1
+
+    def draw_static(self, draw, quality=full_quality):
+        with render_stats.timed('static', self.name):
+            for primitive in self.static:
+                primitive.raster(draw, 0, quality)
+
+    def frame(self, step, quality=full_quality):
+        compiled, dirty_boxes = self.phases[self.phase_of_step[step]]
+        idx = self.index_in_phase[step]
+        dirty_bbox = dirty_boxes[idx]
+        if dirty_bbox is not None and quality != full_quality:
+            dirty_bbox = tuple(math.floor(c * quality.scale) - 1 for c in dirty_bbox[:2]) + \
+                tuple(math.ceil(c * quality.scale) + 1 for c in dirty_bbox[2:])
+
+        def draw_dynamic(draw):
+            for primitive in compiled:
+                with render_stats.timed('raster', type(primitive).__name__.lstrip('_')):
+                    primitive.raster(draw, idx, quality)
+
+        with render_stats.timed('frame', self.name, step):
+            return compose_frame(static_layer(self.draw_static, quality), draw_dynamic, dirty_bbox,
+                                 self.static_key + (frame_mode, quality))
+
+
+def _static_fingerprint(static):
+    # digest of the static geometry and colors
+    digest = hashlib.sha1()
+    for primitive in static:
+        digest.update(type(primitive).__name__.encode())
+        digest.update(np.ascontiguousarray(primitive.points(), dtype=float).tobytes())
+        digest.update(repr(primitive.color).encode())
+    return digest.hexdigest()
+
+
+def _dirty_boxes(compiled, n_frames):
+    if not compiled:
+        return [None] * n_frames
+    points = np.concatenate([primitive.points() for primitive in compiled], axis=1)
+    # generous padding: thick lines get round joints and rasterization rounds outwards
+    pad = max(resistor_outline_width, wire_outline_width) + 2
+    lower = np.floor(points.min(axis=1)).astype(int) - pad
+    upper = np.ceil(points.max(axis=1)).astype(int) + pad + 1
+    return [tuple(box) for box in np.concatenate([lower, upper], axis=1).tolist()]
+
+
+def _turn_step_1(max_steps):
+    return int(max_steps * 18.0 / 31.0)
+
+
+timeline_stage_1 = StageTimeline(
+    name='stage_1',
+    static=[AnimatedResistor(0, 0),
+            AnimatedResistor(-900, 0),
+            AnimatedResistor(+900, 0),
+            AnimatedWire(+250, 0, +650, 0),
+            AnimatedWire(-250, 0, -650, 0),
+            AnimatedWire(-450, 0, -450, +900, +1350, +900, +1350, 0, +1150, 0),
+            AnimatedWire(+450, 0, +450, -900, -1350, -900, -1350, 0, -1150, 0)],
+    phases=[
+        Phase(until=_turn_step_1,
+              variables=lambda v: {'turn_step': _turn_step_1(v.max_steps)},
+              primitives=[
+                  AnimatedWire(+1550, lambda v: +1100 * v.step / v.turn_step,
+                               +1350, lambda v: +900 * v.step / v.turn_step),
+                  AnimatedWire(-1550, lambda v: -1100 * v.step / v.turn_step,
+                               -1350, lambda v: -900 * v.step / v.turn_step),
+                  AnimatedContact(+1550, lambda v: +1100 * v.step / v.turn_step),
+                  AnimatedContact(-1550, lambda v: -1100 * v.step / v.turn_step)]),
+        Phase(variables=lambda v: {'turn_step': _turn_step_1(v.max_steps)},
+              primitives=[
+                  AnimatedWire(lambda v: +1550 - 1550 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step), +1150,
+                               lambda v: +1350 - 1350 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step), +900),
+                  AnimatedWire(lambda v: -1550 + 1550 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step), -1150,
+                               lambda v: -1350 + 1350 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step), -900),
+                  AnimatedContact(lambda v: +1550 - 1550 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step),
+                                  +1150),
+                  AnimatedContact(lambda v: -1550 + 1550 * (v.step - v.turn_step) / (v.max_steps - 1 - v.turn_step),
+                                  -1150)])])
+
+
+def _turn_step_2(max_steps):
+    return int(max_steps * 2.0 / 3.0)
+
+
+timeline_stage_2 = StageTimeline(
+    name='stage_2',
+    static=[AnimatedResistor(0, 0),
+            AnimatedWire(+250, 0, +450, 0),
+            AnimatedWire(-250, 0, -450, 0),
+            AnimatedWire(-450, 0, -450, +900, 0, +900),
+            AnimatedWire(+450, 0, +450, -900, 0, -900),
+            AnimatedWire(0, +1150, 0, +900),
+            AnimatedWire(0, -1150, 0, -900),
+            AnimatedContact(0, +1150),
+            AnimatedContact(0, -1150)],
+    phases=[
+        Phase(until=_turn_step_2,
+              variables=lambda v: {'phi': _atan2(v.step, _turn_step_2(v.max_steps))},
+              primitives=[
+                  AnimatedWire(+450, 0, lambda v: +900 - resistor_length / 2 * _cos(v.phi),
+                               lambda v: +450 * _tan(v.phi) - resistor_length / 2 * _sin(v.phi)),
+                  AnimatedWire(-450, 0, lambda v: -900 + resistor_length / 2 * _cos(v.phi),
+                               lambda v: -450 * _tan(v.phi) + resistor_length / 2 * _sin(v.phi)),
+                  AnimatedWire(0, +900, +1350, +900, +1350, lambda v: +900 * _tan(v.phi),
+                               lambda v: +900 + resistor_length / 2 * _cos(v.phi),
+                               lambda v: +450 * _tan(v.phi) + resistor_length / 2 * _sin(v.phi)),
+                  AnimatedWire(0, -900, -1350, -900, -1350, lambda v: -900 * _tan(v.phi),
+                               lambda v: -900 - resistor_length / 2 * _cos(v.phi),
+                               lambda v: -450 * _tan(v.phi) - resistor_length / 2 * _sin(v.phi)),
+                  AnimatedResistor(+900, lambda v: +450 * _tan(v.phi), angle=lambda v: v.phi),
+                  AnimatedResistor(-900, lambda v: -450 * _tan(v.phi), angle=lambda v: v.phi)]),
+        Phase(variables=lambda v: {'phi': _atan2(v.max_steps - 1 - v.step,
+                                                     v.max_steps - 1 - _turn_step_2(v.max_steps))},
+              primitives=[
+                  AnimatedWire(+450, 0, lambda v: +900 - 450 * _sin(v.phi), 0,
+                               lambda v: +900 - resistor_length / 2 * _sin(v.phi),
+                               lambda v: +450 - resistor_length / 2 * _cos(v.phi)),
+                  AnimatedWire(-450, 0, lambda v: -900 + 450 * _sin(v.phi), 0,
+                               lambda v: -900 + resistor_length / 2 * _sin(v.phi),
+                               lambda v: -450 + resistor_length / 2 * _cos(v.phi)),
+                  AnimatedWire(0, +900, lambda v: +900 + 450 * _tan(v.phi), +900,
+                               lambda v: +900 + resistor_length / 2 * _sin(v.phi),
+                               lambda v: +450 + resistor_length / 2 * _cos(v.phi)),
+                  AnimatedWire(0, -900, lambda v: -900 - 450 * _tan(v.phi), -900,
+                               lambda v: -900 - resistor_length / 2 * _sin(v.phi),
+                               lambda v: -450 - resistor_length / 2 * _cos(v.phi)),
+                  AnimatedResistor(+900, +450, angle=lambda v: math.pi / 2 - v.phi),
+                  AnimatedResistor(-900, -450, angle=lambda v: math.pi / 2 - v.phi)])])
+
+
+timeline_stage_3 = StageTimeline(
+    name='stage_3',
+    static=[AnimatedResistor(0, 0),
+            AnimatedResistor(+900, +450, angle=math.pi / 2),
+            AnimatedResistor(-900, -450, angle=math.pi / 2),
+            AnimatedWire(+250, 0, +900, 0, +900, +200),
+            AnimatedWire(-250, 0, -900, 0, -900, -200),
+            AnimatedWire(0, +1150, 0, +900),
+            AnimatedWire(0, -1150, 0, -900),
+            AnimatedWire(0, +900, +900, +900, +900, +700),
+            AnimatedWire(0, -900, -900, -900, -900, -700),
+            AnimatedContact(0, +1150),
+            AnimatedContact(0, -1150)],
+    phases=[
+        Phase(primitives=[
+            AnimatedWire(lambda v: -450 - 450 * v.step / (v.max_steps - 1), 0,
+                         lambda v: -450 - 450 * v.step / (v.max_steps - 1), +900, 0, +900),
+            AnimatedWire(lambda v: +450 + 450 * v.step / (v.max_steps - 1), 0,
+                         lambda v: +450 + 450 * v.step / (v.max_steps - 1), -900, 0, -900)])])
+
+
+def _turn_step_4(max_steps):
+    return int(max_steps * 0.5)
+
+
+timeline_stage_4 = StageTimeline(
+    name='stage_4',
+    static=[AnimatedResistor(+900, +450, angle=math.pi / 2),
+            AnimatedResistor(-900, -450, angle=math.pi / 2),
+            AnimatedWire(0, +1150, 0, +900),
+            AnimatedWire(0, -1150, 0, -900),
+            AnimatedWire(0, +900, +900, +900, +900, +700),
+            AnimatedWire(0, -900, -900, -900, -900, -700),
+            AnimatedWire(-900, -200, -900, +900, 0, +900),
+            AnimatedWire(+900, +200, +900, -900, 0, -900),
+            AnimatedContact(0, +1150),
+            AnimatedContact(0, -1150)],
+    phases=[
+        Phase(until=_turn_step_4,
+              variables=lambda v: {'phi': -_atan2(900 * v.step / _turn_step_4(v.max_steps), 900)},
+              primitives=[
+                  AnimatedResistor(0, 0, angle=lambda v: v.phi),
+                  AnimatedWire(lambda v: +resistor_length / 2 * _cos(v.phi),
+                               lambda v: +resistor_length / 2 * _sin(v.phi),
+                               +900, lambda v: +900 * _tan(v.phi)),
+                  AnimatedWire(lambda v: -resistor_length / 2 * _cos(v.phi),
+                               lambda v: -resistor_length / 2 * _sin(v.phi),
+                               -900, lambda v: -900 * _tan(v.phi))]),
+        Phase(variables=lambda v: {'phi': _atan2(v.max_steps - 1 - v.step,
+                                                     v.max_steps - 1 - _turn_step_4(v.max_steps))},
+              primitives=[
+                  AnimatedResistor(0, 0, angle=lambda v: v.phi - math.pi / 2),
+                  AnimatedWire(lambda v: +resistor_length / 2 * _sin(v.phi),
+                               lambda v: -resistor_length / 2 * _cos(v.phi),
+                               lambda v: +900 * _tan(v.phi), -900),
+                  AnimatedWire(lambda v: -resistor_length / 2 * _sin(v.phi),
+                               lambda v: +resistor_length / 2 * _cos(v.phi),
+                               lambda v: -900 * _tan(v.phi), +900)])])
+
+
+timeline_stage_5 = StageTimeline(
+    name='stage_5',
+    static=[AnimatedResistor(0, 0, angle=math.pi / 2),
+            AnimatedWire(0, +1150, 0, +resistor_length / 2),
+            AnimatedWire(0, -1150, 0, -resistor_length / 2),
+            AnimatedContact(0, +1150),
+            AnimatedContact(0, -1150)],
+    phases=[
+        Phase(primitives=[
+            AnimatedResistor(+900, lambda v: +450 - 450 * v.step / (v.max_steps - 1), angle=math.pi / 2),
+            AnimatedResistor(-900, lambda v: -450 + 450 * v.step / (v.max_steps - 1), angle=math.pi / 2),
+            AnimatedWire(0, +900, +900, +900,
+                         +900, lambda v: +700 - (700 - resistor_length / 2) * v.step / (v.max_steps - 1)),
+            AnimatedWire(0, -900, -900, -900,
+                         -900, lambda v: -700 + (700 - resistor_length / 2) * v.step / (v.max_steps - 1)),
+            AnimatedWire(-900, lambda v: -200 + (200 + resistor_length / 2) * v.step / (v.max_steps - 1),
+                         -900, +900, 0, +900),
+            AnimatedWire(+900, lambda v: +200 - (200 + resistor_length / 2) * v.step / (v.max_steps - 1),
+                         +900, -900, 0, -900)])])
+
+
+def create_frame_stage_1(step, max_steps, quality=full_quality):
+    return timeline_stage_1.frame(step, max_steps, quality)
+
+
+def create_frame_stage_2(step, max_steps, quality=full_quality):
+    return timeline_stage_2.frame(step, max_steps, quality)
+
+
+def create_frame_stage_3(step, max_steps, quality=full_quality):
+    return timeline_stage_3.frame(step, max_steps, quality)
+
+
+def create_frame_stage_4(step, max_steps, quality=full_quality):
+    return timeline_stage_4.frame(step, max_steps, quality)
+
+
+def create_frame_stage_5(step, max_step, quality=full_quality):
+    return timeline_stage_5.frame(step, max_step, quality)
+
+
+# the timelines behind the create_frame functions, for exports that need the primitives rather than frames
+timelines = {create_frame_stage_1: timeline_stage_1,
+             create_frame_stage_2: timeline_stage_2,
+             create_frame_stage_3: timeline_stage_3,
+             create_frame_stage_4: timeline_stage_4,
+             create_frame_stage_5: timeline_stage_5}
+
+
+def timeline_colors(stage_timelines):
+    colors = []
+    for timeline in stage_timelines:
+        for primitive in timeline.static + [p for phase in timeline.phases for p in phase.primitives]:
+            if primitive.color not in colors:
+                colors.append(primitive.color)
+    return colors
+
+
+frame_colors = timeline_colors(timelines.values())
+
+stages = [(create_frame_stage_1, 30),
+          (create_frame_stage_2, 30),
+          (create_frame_stage_3, 15),
+          (create_frame_stage_4, 30),
+          (create_frame_stage_5, 10)]
+
+
+def _frame_jobs(timeline, quality):
+    return [(create_frame, step, max_steps, quality) for create_frame, max_steps in timeline or stages
+            for step in range(max_steps)]
+
+
+def _create_frame(job):
+    # create_frame functions only have to take a quality when one is asked for
+    create_frame, step, max_steps, quality = job
+    if quality == full_quality:
+        return create_frame(step, max_steps)
+    return create_frame(step, max_steps, quality)
+
+
+def generate_frames(timeline=None, quality=full_quality):
+    for job in _frame_jobs(timeline, quality):
+        yield _create_frame(job)
+
+
+# Frames rendered on demand, for previews that jump around the animation. Rendered frames are kept in a LRU limited
+# by their pixel buffer sizes and a background thread renders the frames next to the last one asked for, in the
+# direction the viewer moves. Cached frames are shared, callers must not draw on them.
+frame_cache_bytes = 256 * 1024 * 1024
+frame_prefetch = 2
+logger = logging.getLogger(__name__)
+
+
+def _frame_bytes(frame):
+    return frame.width * frame.height * len(frame.getbands())
+
+
+class FrameCache:
+    def __init__(self, max_bytes=frame_cache_bytes, prefetch=frame_prefetch):
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.frames = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # stage timelines and static layers are cached globally, so frames are rendered one at a time
+        self._render_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wanted = []
+        self._wanted_changed = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+
+    def _key(self, job):
+        # frames depend on the frame size and mode as well
+        return job + (image_resize_factor, image_width, image_height, frame_mode)
+
+    def _lookup(self, key):
+        with self._lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def frame(self, job, count=True):
+        key = self._key(job)
+        frame = self._lookup(key)
+        if frame is None:
+            with self._render_lock:
+                # the prefetch thread may have rendered it meanwhile
+                frame = self._lookup(key)
+                if frame is None:
+                    frame = _create_frame(job)
+                    self._store(key, frame)
+                    if count:
+                        self.misses += 1
+                    return frame
+        if count:
+            self.hits += 1
+        return frame
+
+    def _store(self, key, frame):
+        with self._lock:
+            if _frame_bytes(frame) > self.max_bytes:
+                return
+            self.frames[key] = frame
+            self.bytes += _frame_bytes(frame)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.bytes -= _frame_bytes(evicted)
+
+    def want(self, jobs):
+        # replaces what is left of the previous wish list, scrubbing past frames drops their prefetch
+        if not self.prefetch:
+            return
+        with self._lock:
+            self._wanted = [job for job in jobs if self._key(job) not in self.frames]
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+                self._thread.start()
+            self._wanted_changed.notify()
+
+    def _prefetch_loop(self):
+        try:
+            while True:
+                with self._lock:
+                    while not self._wanted and not self._closed:
+                        self._wanted_changed.wait()
+                    if self._closed:
+                        return
+                    job = self._wanted.pop(0)
+                try:
+                    self.frame(job, count=False)
+                except Exception:
+                    # the frame is not cached, asking for it renders it again and raises to the caller
+                    logger.exception('prefetching frame %s failed', job)
+        finally:
+            # want starts a new thread should this one end anyway
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wanted_changed.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class FrameSequence:
+    # random access to the frames of a timeline of (create_frame, max_steps), slices share the cache
+    def __init__(self, timeline=None, cache=None, jobs=None, quality=full_quality):
+        self.jobs = jobs if jobs is not None else _frame_jobs(timeline, quality)
+        self.cache = cache if cache is not None else FrameCache()
+        self._last = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return FrameSequence(cache=self.cache, jobs=self.jobs[idx])
+        if idx < 0:
+            idx += len(self.jobs)
+        if not 0 <= idx < len(self.jobs):
+            raise IndexError('frame index out of range')
+        frame = self.cache.frame(self.jobs[idx])
+        direction = -1 if self._last is not None and idx < self._last else 1
+        self._last = idx
+        neighbours = [idx + direction * offset for offset in range(1, self.cache.prefetch + 1)]
+        self.cache.want([self.jobs[i] for i in neighbours if 0 <= i < len(self.jobs)])
+        return frame
+
+    def __iter__(self):
+        for idx in range(len(self.jobs)):
+            yield self[idx]
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def define_symbols(svg):
+    # symbols in frame pixels around their centres, placed and coloured by the compiled primitives
+    half_length = resistor_length * image_resize_factor / 2
+    half_width = resistor_width * image_resize_factor / 2
+    half_contact = contact_size * image_resize_factor / 2
+    svg.define('resistor', lambda d: raster_resistor_box(d, [-half_length, -half_width, half_length, half_width],
+                                                         'currentColor'))
+    svg.define('contact', lambda d: raster_contact(d, [-half_contact, -half_contact, half_contact, half_contact],
+                                                   [-half_contact, half_contact, half_contact, -half_contact],
+                                                   'currentColor'))
+
+
+def save_svg_animation(file_name, timeline=None, duration=20, loop=None):
+    # one SVG for the whole animation: the static part of every stage and every frame are groups of symbol
+    # placements and wires, shown in turn, so its size grows with the primitives and not with the pixels
+    timeline = timeline or stages
+    n_frames = sum(max_steps for _, max_steps in timeline)
+    svg = SvgDraw((int(image_width * image_resize_factor), int(image_height * image_resize_factor)))
+    define_symbols(svg)
+    first = 0
+    for create_frame, max_steps in timeline:
+        if create_frame not in timelines:
+            raise ValueError('{} has no stage timeline'.format(create_frame.__name__))
+        compiled = timelines[create_frame].compile(max_steps)
+        with svg.group(frame_visibility(first, first + max_steps - 1, n_frames, duration / 1000, loop), hidden=True):
+            for primitive in compiled.static:
+                primitive.vector(svg, 0)
+        for step in range(max_steps):
+            primitives, _ = compiled.phases[compiled.phase_of_step[step]]
+            with svg.group(frame_visibility(first + step, first + step, n_frames, duration / 1000, loop),
+                           hidden=True):
+                for primitive in primitives:
+                    primitive.vector(svg, compiled.index_in_phase[step])
+        first += max_steps
+    svg.save(file_name)
+
+
+def demo(image_format='GIF', quality=full_quality):
+    # plays twice in every format
+    if image_format == 'SVG':
+        return save_svg_animation('scheme_transformation.svg', duration=20, loop=1)
+    file_name = 'scheme_transformation.gif' if image_format == 'GIF' else 'scheme_transformation.png'
+    return save_animation(generate_frames(quality=quality), file_name, image_format, duration=20, loop=1)
 
 
 if __name__ == '__main__':
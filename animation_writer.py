@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Iterable, List, Optional, Tuple, Union
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from io import BytesIO
+from PIL import Image, ImageChops, GifImagePlugin
+import struct
+import time
+import zlib
+
+import render_stats
+
+
+BoxInt = Tuple[int, int, int, int]
+
+# GIF disposal method: leave the frame in place, so the next frame only has to cover what changed
+gif_disposal_none: int = 1
+# APNG dispose_op and blend_op
+apng_dispose_none: int = 0
+apng_blend_source: int = 0
+# loop means the same in every writer, as in Image.save for GIF: None plays the animation once, 0 repeats it forever
+# and k repeats it k more times
+
+
+@dataclass
+class EncodeStats:
+    frames: int = 0
+    frames_written: int = 0
+    pixels_total: int = 0
+    pixels_written: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+    # filled in only when the writer is asked to measure full frame encoding as well
+    full_frame_bytes: Optional[int] = None
+    full_frame_seconds: Optional[float] = None
+
+    def bytes_saved(self) -> Optional[int]:
+        return None if self.full_frame_bytes is None else self.full_frame_bytes - self.bytes_written
+
+    def seconds_saved(self) -> Optional[float]:
+        return None if self.full_frame_seconds is None else self.full_frame_seconds - self.seconds
+
+
+def _unused_index(image: Image.Image) -> Optional[int]:
+    # the first index after the palette, or the last index not used in the image
+    n_colors: int = len(image.getpalette()) // 3 if image.mode == 'P' else 256
+    if n_colors < 256:
+        return n_colors
+    for idx, count in reversed(list(enumerate(image.histogram()))):
+        if count == 0:
+            return idx
+    return None
+
+
+def _comparable(previous: Image.Image, frame: Image.Image) -> Tuple[Image.Image, Image.Image]:
+    # frames of different modes, and palette images with different palettes, are compared by color
+    if previous.mode == frame.mode and (frame.mode != 'P' or previous.getpalette() == frame.getpalette()):
+        return previous, frame
+    mode: str = 'RGBA' if any('A' in image.getbands() or 'transparency' in image.info
+                              for image in (previous, frame)) else 'RGB'
+    return previous.convert(mode), frame.convert(mode)
+
+
+def _unchanged_mask(delta: Image.Image) -> Image.Image:
+    # 255 where the difference image is zero in every band
+    if delta.mode == 'P':
+        # difference of palette indices of frames with the same palette, see _comparable
+        delta = Image.frombytes('L', delta.size, delta.tobytes())
+    changed: Image.Image = delta.getchannel(0)
+    for band in range(1, len(delta.getbands())):
+        changed = ImageChops.lighter(changed, delta.getchannel(band))
+    return changed.point(lambda v: 255 if v == 0 else 0)
+
+
+def _changed_region(previous: Image.Image, frame: Image.Image) -> Optional[BoxInt]:
+    # frames composed over the same static layer can only differ inside their dirty boxes
+    # (see AnimateScheme.compose_frame), other frames have to be compared as a whole
+    static_layer = frame.info.get('static_layer')
+    if static_layer is None or previous.info.get('static_layer') != static_layer:
+        return (0, 0) + frame.size
+    boxes = [box for box in (previous.info.get('dirty_bbox'), frame.info.get('dirty_bbox')) if box is not None]
+    if not boxes:
+        return None
+    region: BoxInt = (max(min(box[0] for box in boxes), 0), max(min(box[1] for box in boxes), 0),
+                      min(max(box[2] for box in boxes), frame.width), min(max(box[3] for box in boxes), frame.height))
+    if region[0] >= region[2] or region[1] >= region[3]:
+        return None
+    return region
+
+
+class DeltaFrameWriter(ABC):
+    # base of the streaming animation writers
+    # every frame after the first is diffed against the previous one and only the changed region is encoded at its
+    # offset, identical frames extend the duration of the previous one; only the previous frame and one pending
+    # encoded frame are kept in memory
+
+    def __init__(self, fp: BinaryIO, duration: int = 0, loop: Optional[int] = None,
+                 measure_full_frames: bool = False) -> None:
+        self.fp: BinaryIO = fp
+        self.duration: int = duration
+        self.loop: Optional[int] = loop
+        self.measure_full_frames: bool = measure_full_frames
+        self.stats: EncodeStats = EncodeStats()
+        self._previous: Optional[Image.Image] = None
+        # encoded image, offset, duration and transparent index of the frame waiting to be written
+        self._pending: Optional[Tuple[Image.Image, Tuple[int, int], int, Optional[int]]] = None
+        self._header_written: bool = False
+        if measure_full_frames:
+            self.stats.full_frame_bytes = 0
+            self.stats.full_frame_seconds = 0.0
+
+    def __enter__(self) -> DeltaFrameWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, frame: Image.Image) -> None:
+        if self.measure_full_frames:
+            self._measure_full_frame(frame)
+        start: float = time.perf_counter()
+        self.stats.frames += 1
+        self.stats.pixels_total += frame.width * frame.height
+
+        delta: Optional[Image.Image] = None
+        bbox: Optional[BoxInt] = None
+        with render_stats.timed('encode', 'diff'):
+            if self._previous is not None:
+                region: Optional[BoxInt] = _changed_region(self._previous, frame)
+                if region is not None:
+                    delta = ImageChops.difference(*_comparable(self._previous.crop(region), frame.crop(region)))
+                    bbox = delta.getbbox()
+                if bbox is not None:
+                    delta = delta.crop(bbox)
+                    bbox = (bbox[0] + region[0], bbox[1] + region[1], bbox[2] + region[0], bbox[3] + region[1])
+        if self._previous is not None and bbox is None:
+            image, offset, duration, transparency = self._pending
+            self._pending = image, offset, duration + self.duration, transparency
+            self.stats.seconds += time.perf_counter() - start
+            return
+        self._flush()
+
+        with render_stats.timed('encode', 'prepare'):
+            image: Image.Image = self._prepare(frame)
+            offset: Tuple[int, int] = (0, 0)
+            transparency: Optional[int] = None
+            if bbox is not None:
+                if bbox != (0, 0) + frame.size:
+                    image = image.crop(bbox)
+                    offset = bbox[:2]
+                transparency = self._mask_unchanged(image, delta)
+        self._pending = image, offset, self.duration, transparency
+        self._previous = frame
+        self.stats.seconds += time.perf_counter() - start
+
+    def close(self) -> None:
+        start: float = time.perf_counter()
+        self._flush()
+        if self._header_written:
+            self._write_trailer()
+        self.fp.flush()
+        self.stats.seconds += time.perf_counter() - start
+
+    def _flush(self) -> None:
+        if self._pending is None:
+            return
+        image, offset, duration, transparency = self._pending
+        self._pending = None
+        with render_stats.timed('encode', 'write'):
+            if not self._header_written:
+                self._write_header(image, duration)
+                self._header_written = True
+            self._write_frame(image, offset, duration, transparency)
+        self.stats.frames_written += 1
+        self.stats.pixels_written += image.width * image.height
+
+    def _write(self, data: bytes) -> None:
+        self.fp.write(data)
+        self.stats.bytes_written += len(data)
+
+    def _measure_full_frame(self, frame: Image.Image) -> None:
+        start: float = time.perf_counter()
+        with render_stats.timed('encode', 'full_frame'):
+            self.stats.full_frame_bytes += self._encode_full_frame(frame)
+        self.stats.full_frame_seconds += time.perf_counter() - start
+
+    def _prepare(self, frame: Image.Image) -> Image.Image:
+        return frame.copy()
+
+    def _mask_unchanged(self, image: Image.Image, delta: Image.Image) -> Optional[int]:
+        return None
+
+    @abstractmethod
+    def _encode_full_frame(self, frame: Image.Image) -> int:
+        pass
+
+    @abstractmethod
+    def _write_header(self, image: Image.Image, duration: int) -> None:
+        pass
+
+    @abstractmethod
+    def _write_frame(self, image: Image.Image, offset: Tuple[int, int], duration: int,
+                     transparency: Optional[int]) -> None:
+        pass
+
+    @abstractmethod
+    def _write_trailer(self) -> None:
+        pass
+
+
+class GifStreamWriter(DeltaFrameWriter):
+    # follows Image.save(..., save_all=True): unchanged pixels inside the changed region become transparent
+
+    def _prepare(self, frame: Image.Image) -> Image.Image:
+        return frame.copy() if frame.mode in ('P', 'L') else frame.convert('P', palette=Image.ADAPTIVE)
+
+    def _mask_unchanged(self, image: Image.Image, delta: Image.Image) -> Optional[int]:
+        transparency: Optional[int] = _unused_index(image)
+        if transparency is not None:
+            image.paste(transparency, mask=_unchanged_mask(delta))
+        return transparency
+
+    def _encode_full_frame(self, frame: Image.Image) -> int:
+        chunks: List[bytes] = GifImagePlugin.getdata(self._prepare(frame), (0, 0), duration=self.duration,
+                                                     include_color_table=True)
+        return sum(len(chunk) for chunk in chunks)
+
+    def _write_header(self, image: Image.Image, duration: int) -> None:
+        header, _ = GifImagePlugin.getheader(image, info={'duration': duration, 'loop': self.loop})
+        for chunk in header:
+            self._write(chunk)
+
+    def _write_frame(self, image: Image.Image, offset: Tuple[int, int], duration: int,
+                     transparency: Optional[int]) -> None:
+        info = {'duration': duration, 'disposal': gif_disposal_none}
+        if transparency is not None:
+            info['transparency'] = transparency
+        if self.stats.frames_written:
+            info['include_color_table'] = True
+        for chunk in GifImagePlugin.getdata(image, offset, **info):
+            self._write(chunk)
+
+    def _write_trailer(self) -> None:
+        self._write(b';')
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _png_chunks(image: Image.Image) -> List[Tuple[bytes, bytes]]:
+    # lets Pillow do the filtering and compression and takes the resulting chunks apart
+    # palette images always get 8 bits per pixel, Pillow would pick fewer for small palettes
+    buffer: BytesIO = BytesIO()
+    image.save(buffer, format='PNG', **({'bits': 8} if image.mode == 'P' else {}))
+    data: bytes = buffer.getvalue()
+    chunks: List[Tuple[bytes, bytes]] = []
+    position: int = 8
+    while position < len(data):
+        length, = struct.unpack('>I', data[position:position + 4])
+        chunks.append((data[position + 4:position + 8], data[position + 8:position + 8 + length]))
+        position += 12 + length
+    return chunks
+
+
+def _to_palette(frame: Image.Image, palette: List[int]) -> Image.Image:
+    # nearest colors of a fixed palette, exact for the colors it has
+    palette_image: Image.Image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+    return frame.convert('RGB').quantize(palette=palette_image, dither=Image.NONE)
+
+
+def _apng_delay(duration: int) -> Tuple[int, int]:
+    # fcTL delay_num and delay_den are 16 bits each, long delays lose precision instead of overflowing
+    for denominator in (1000, 100, 10, 1):
+        numerator: int = round(duration * denominator / 1000)
+        if numerator <= 0xFFFF:
+            return numerator, denominator
+    return 0xFFFF, 1
+
+
+def _apng_plays(loop: Optional[int]) -> int:
+    # acTL num_plays counts all plays, 0 for forever
+    if loop is None:
+        return 1
+    return 0 if loop == 0 else loop + 1
+
+
+class ApngStreamWriter(DeltaFrameWriter):
+    # changed regions replace the canvas content (blend_op SOURCE) and stay in place (dispose_op NONE)
+    # the number of frames is known only at the end, so fp has to be seekable
+    # IHDR and PLTE are those of the first frame, later frames are converted to its mode and palette, where colors
+    # missing from that palette become the nearest one in it
+
+    def __init__(self, fp: BinaryIO, duration: int = 0, loop: Optional[int] = None,
+                 measure_full_frames: bool = False) -> None:
+        super().__init__(fp, duration, loop, measure_full_frames)
+        self._sequence: int = 0
+        self._actl_position: int = 0
+        self._mode: Optional[str] = None
+        self._palette: Optional[List[int]] = None
+        # chunks of the first frame, encoded once for the header and the frame
+        self._first_chunks: Optional[List[Tuple[bytes, bytes]]] = None
+
+    def _prepare(self, frame: Image.Image) -> Image.Image:
+        if self._mode is None:
+            self._mode = frame.mode
+            self._palette = frame.getpalette() if frame.mode == 'P' else None
+        if self._mode == 'P' and (frame.mode != 'P' or frame.getpalette() != self._palette):
+            return _to_palette(frame, self._palette)
+        if frame.mode != self._mode:
+            return frame.convert(self._mode)
+        return frame.copy()
+
+    def _encode_full_frame(self, frame: Image.Image) -> int:
+        return sum(12 + len(data) for chunk_type, data in _png_chunks(frame) if chunk_type == b'IDAT')
+
+    def _write_header(self, image: Image.Image, duration: int) -> None:
+        self._write(b'\x89PNG\r\n\x1a\n')
+        self._first_chunks = _png_chunks(image)
+        for chunk_type, data in self._first_chunks:
+            if chunk_type == b'IHDR':
+                self._write(_png_chunk(chunk_type, data))
+                self._actl_position = self.fp.tell()
+                self._write(_png_chunk(b'acTL', struct.pack('>II', 0, _apng_plays(self.loop))))
+            elif chunk_type in (b'PLTE', b'tRNS'):
+                self._write(_png_chunk(chunk_type, data))
+
+    def _write_frame(self, image: Image.Image, offset: Tuple[int, int], duration: int,
+                     transparency: Optional[int]) -> None:
+        self._write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self._sequence, image.width, image.height,
+                                                    offset[0], offset[1], *_apng_delay(duration),
+                                                    apng_dispose_none, apng_blend_source)))
+        self._sequence += 1
+        chunks: List[Tuple[bytes, bytes]] = self._first_chunks or _png_chunks(image)
+        self._first_chunks = None
+        for chunk_type, data in chunks:
+            if chunk_type != b'IDAT':
+                continue
+            if not self.stats.frames_written:
+                self._write(_png_chunk(b'IDAT', data))
+            else:
+                self._write(_png_chunk(b'fdAT', struct.pack('>I', self._sequence) + data))
+                self._sequence += 1
+
+    def _write_trailer(self) -> None:
+        self._write(_png_chunk(b'IEND', b''))
+        end: int = self.fp.tell()
+        self.fp.seek(self._actl_position)
+        self.fp.write(_png_chunk(b'acTL', struct.pack('>II', self.stats.frames_written, _apng_plays(self.loop))))
+        self.fp.seek(end)
+
+
+writers = {
+    'GIF': GifStreamWriter,
+    'PNG': ApngStreamWriter,
+}
+
+
+def save_animation(frames: Iterable[Image.Image], pf: Union[BinaryIO, str], image_format: str = 'GIF',
+                   duration: int = 0, loop: Optional[int] = None, measure_full_frames: bool = False) -> EncodeStats:
+    file: BinaryIO = open(pf, 'wb') if isinstance(pf, str) else pf
+    try:
+        with writers[image_format](file, duration, loop, measure_full_frames) as writer:
+            for frame in frames:
+                writer.write(frame)
+        return writer.stats
+    finally:
+        if isinstance(pf, str):
+            file.close()
+
+
+def save_gif(frames: Iterable[Image.Image], pf: Union[BinaryIO, str], duration: int = 0,
+             loop: Optional[int] = None) -> EncodeStats:
+    return save_animation(frames, pf, 'GIF', duration, loop)
+
+
+def save_apng(frames: Iterable[Image.Image], pf: Union[BinaryIO, str], duration: int = 0,
+              loop: Optional[int] = None) -> EncodeStats:
+    return save_animation(frames, pf, 'PNG', duration, loop)
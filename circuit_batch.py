@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from multiprocessing import Pool
+from PIL import Image
+import argparse
+import io
+import json
+import os
+import tarfile
+import time
+
+from circuit_scheme import Circuit, clear_image, create_image
+import circuit_format
+
+
+# A job renders the whole bounding box of one circuit file (any format circuit_format.load reads) into a PNG.
+# Jobs are read from JSON lines such as
+#     {"circuit": "a.bin", "size": [128, 128], "output": "a_128.png", "mode": "RGB"}
+# or built for every combination of the given circuit files and sizes.
+# Workers send the encoded PNGs back and the parent writes all of them through one buffered writer, either into a
+# directory or into a single tar archive, so thousands of thumbnails do not need thousands of open handles at once.
+
+# circuits and image buffers kept by every worker, jobs are sorted so that a worker gets runs of the same circuit
+worker_cache_size: int = 8
+write_buffer_size: int = 1 << 20
+
+
+@dataclass
+class BatchJob:
+    circuit: str
+    size: Tuple[int, int]
+    output: str
+    mode: str = 'RGB'
+
+
+@dataclass
+class JobResult:
+    index: int
+    output: str
+    load_seconds: float = 0.0
+    render_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    write_seconds: float = 0.0
+    n_bytes: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchReport:
+    results: List[JobResult]
+    elapsed: float = 0.0
+
+    def failed(self) -> List[JobResult]:
+        return [result for result in self.results if result.error is not None]
+
+    def total(self, name: str) -> float:
+        return sum(getattr(result, name) for result in self.results)
+
+
+def safe_output_name(name: str) -> str:
+    # output names are relative paths that stay inside the output directory or archive
+    parts: List[str] = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith(('/', '\\')) or os.path.splitdrive(name)[0]:
+        raise ValueError('output name {!r} is not a relative path inside the output'.format(name))
+    return '/'.join(parts)
+
+
+class BatchWriter:
+    # outputs ending in .tar are written as one archive, anything else is a directory
+    def __init__(self, output: str) -> None:
+        self.output: str = output
+        self.archive: Optional[tarfile.TarFile] = None
+        self.file: Optional[BinaryIO] = None
+        if output.endswith('.tar'):
+            self.file = open(output, 'wb', buffering=write_buffer_size)
+            self.archive = tarfile.open(fileobj=self.file, mode='w|')
+
+    def write(self, name: str, data: bytes) -> None:
+        name = safe_output_name(name)
+        if self.archive is not None:
+            info: tarfile.TarInfo = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self.archive.addfile(info, io.BytesIO(data))
+            return
+        path: str = os.path.join(self.output, name)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def close(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+            self.file.close()
+            self.archive = self.file = None
+
+    def __enter__(self) -> BatchWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_worker_circuits: OrderedDict = OrderedDict()
+_worker_images: OrderedDict = OrderedDict()
+
+
+def _cached(cache: OrderedDict, key, make):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = make()
+    if len(cache) > worker_cache_size:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def render_image(circuit: Circuit, size: Tuple[int, int], mode: str = 'RGB',
+                 image: Optional[Image.Image] = None) -> Image.Image:
+    # an empty circuit gives an empty image rather than no image
+    if circuit.bbox is None:
+        return create_image(size, mode) if image is None else clear_image(image)
+    return circuit.render_region(circuit.bbox, size, mode, image)
+
+
+def _render_job(indexed_job: Tuple[int, BatchJob]) -> Tuple[JobResult, Optional[bytes]]:
+    index, job = indexed_job
+    result: JobResult = JobResult(index, job.output)
+    try:
+        result.output = safe_output_name(job.output)
+        start: float = time.perf_counter()
+        circuit: Circuit = _cached(_worker_circuits, job.circuit, lambda: circuit_format.load(job.circuit))
+        result.load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image: Image.Image = _cached(_worker_images, (job.size, job.mode), lambda: create_image(job.size, job.mode))
+        render_image(circuit, job.size, job.mode, image)
+        result.render_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        buffer: io.BytesIO = io.BytesIO()
+        image.save(buffer, format='PNG')
+        result.encode_seconds = time.perf_counter() - start
+    except Exception as error:
+        # any failure only fails its own job, the batch goes on
+        result.error = '{}: {}'.format(type(error).__name__, error)
+        return result, None
+    result.n_bytes = buffer.tell()
+    return result, buffer.getvalue()
+
+
+def render_batch(jobs: Iterable[BatchJob], output: str, workers: Optional[int] = None, chunk_size: int = 16) \
+        -> BatchReport:
+    start_time: float = time.time()
+    # output names are checked up front, a name given again fails the later jobs instead of overwriting the output
+    results: List[JobResult] = []
+    indexed_jobs: List[Tuple[int, BatchJob]] = []
+    first_jobs: Dict[str, int] = {}
+    for index, job in enumerate(jobs):
+        try:
+            name: str = safe_output_name(job.output)
+        except ValueError as error:
+            results.append(JobResult(index, job.output, error='ValueError: {}'.format(error)))
+            continue
+        if name in first_jobs:
+            results.append(JobResult(index, job.output, error='output name {!r} is already written by job {}'.format(
+                name, first_jobs[name])))
+            continue
+        first_jobs[name] = index
+        indexed_jobs.append((index, job))
+    indexed_jobs.sort(key=lambda item: (item[1].circuit, item[1].size, item[1].mode))
+    with BatchWriter(output) as writer:
+        def write_all(rendered: Iterator[Tuple[JobResult, Optional[bytes]]]) -> None:
+            for result, data in rendered:
+                if data is not None:
+                    start: float = time.perf_counter()
+                    try:
+                        writer.write(result.output, data)
+                    except Exception as error:
+                        result.error = '{}: {}'.format(type(error).__name__, error)
+                    result.write_seconds = time.perf_counter() - start
+                results.append(result)
+
+        if workers == 1:
+            write_all(map(_render_job, indexed_jobs))
+        elif indexed_jobs:
+            with Pool(workers) as pool:
+                write_all(pool.imap_unordered(_render_job, indexed_jobs, chunk_size))
+
+    results.sort(key=lambda result: result.index)
+    return BatchReport(results, time.time() - start_time)
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    width, _, height = text.partition('x')
+    return int(width), int(height or width)
+
+
+def read_jobs(file: Iterable[str]) -> Iterator[BatchJob]:
+    for line in file:
+        if line.strip():
+            job = json.loads(line)
+            yield BatchJob(job['circuit'], tuple(job['size']), job['output'], job.get('mode', 'RGB'))
+
+
+def product_jobs(circuits: Iterable[str], sizes: List[Tuple[int, int]], mode: str = 'RGB') -> Iterator[BatchJob]:
+    for path in circuits:
+        stem: str = os.path.splitext(os.path.basename(path))[0]
+        for size in sizes:
+            yield BatchJob(path, size, '{}_{}x{}.png'.format(stem, *size), mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='renders many circuit files into PNG images')
+    parser.add_argument('output', help='directory, or a .tar archive')
+    parser.add_argument('circuits', nargs='*')
+    parser.add_argument('--jobs', default=None, help='JSON lines file with one job per line')
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[(256, 256)], help='WIDTHxHEIGHT')
+    parser.add_argument('--mode', default='RGB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--report', default=None, help='JSON file for the per job timings')
+    args = parser.parse_args()
+
+    batch_jobs: List[BatchJob] = list(product_jobs(args.circuits, args.sizes, args.mode))
+    if args.jobs is not None:
+        with open(args.jobs) as jobs_file:
+            batch_jobs += read_jobs(jobs_file)
+
+    batch_report: BatchReport = render_batch(batch_jobs, args.output, args.workers)
+    for failed in batch_report.failed():
+        print('FAILED', failed.output, failed.error)
+    print('rendered', len(batch_report.results) - len(batch_report.failed()), 'of', len(batch_report.results),
+          'images in', batch_report.elapsed, 's')
+    for name in ('load_seconds', 'render_seconds', 'encode_seconds', 'write_seconds'):
+        print('{:15} {:.3f} s'.format(name, batch_report.total(name)))
+    if args.report is not None:
+        with open(args.report, 'w') as report_file:
+            json.dump({'elapsed': batch_report.elapsed, 'jobs': [asdict(result) for result in batch_report.results]},
+                      report_file, indent=1)
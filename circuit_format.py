@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Dict, List, Optional, TextIO, Tuple, Type
+from dataclasses import fields
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from circuit_scheme import BoundBox, Circuit, CircuitElement, ElementStore, element_types
+
+
+# Text format: a 'circuit 1' line, then one line per element with its class name and field values, e.g.
+#     Contact 0.0 1000.0
+# Lines that are empty or start with '#' are skipped.
+#
+# Binary format, little endian, every section starts at a multiple of 8 bytes:
+#     header       binary_header_dtype
+#     type table   n_types records of type_record_dtype: class name, number of fields, number of elements and
+#                  the offset of their float64 values, one row per element
+#     type ids     int8 per element, the position of its class in the type table
+#     rows         int64 per element, its row in the values of its class
+#     values       per class
+# Loading maps the file and uses these columns in place, no object is created per element.
+
+text_magic: str = 'circuit 1'
+binary_magic: bytes = b'CIRCUITB'
+binary_version: int = 1
+binary_header_dtype: np.dtype = np.dtype([('magic', 'S8'), ('version', '<u4'), ('n_types', '<u4'),
+                                          ('n_elements', '<u8'), ('bbox', '<f8', (4,)),
+                                          ('type_ids_offset', '<u8'), ('rows_offset', '<u8')])
+type_record_dtype: np.dtype = np.dtype([('name', 'S32'), ('n_fields', '<u4'), ('padding', '<u4'),
+                                        ('count', '<u8'), ('values_offset', '<u8')])
+
+
+class CircuitFormatError(ValueError):
+    pass
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _element_type(name: str) -> Type[CircuitElement]:
+    if name not in element_types:
+        raise CircuitFormatError('unknown element type ' + repr(name))
+    return element_types[name]
+
+
+def _bbox_from_array(bbox: np.ndarray) -> Optional[BoundBox]:
+    if np.isnan(bbox).any():
+        return None
+    x0, y0, x1, y1 = bbox.tolist()
+    return (x0, y0), (x1, y1)
+
+
+def write_text(circuit: Circuit, file: TextIO) -> None:
+    store: ElementStore = circuit.elements
+    names: List[str] = [element_type.__name__ for element_type in store.element_types]
+    file.write(text_magic + '\n')
+    for type_id, row in zip(store.type_ids[:store.size].tolist(), store.rows[:store.size].tolist()):
+        file.write(' '.join([names[type_id]] + [repr(v) for v in store.values[type_id][row].tolist()]) + '\n')
+
+
+def read_text(file: TextIO) -> Circuit:
+    if file.readline().strip() != text_magic:
+        raise CircuitFormatError('not a circuit text file')
+    types: List[Type[CircuitElement]] = []
+    type_positions: Dict[str, int] = {}
+    values: List[List[List[float]]] = []
+    type_ids: List[int] = []
+    for line_number, line in enumerate(file, 2):
+        tokens: List[str] = line.split()
+        if not tokens or tokens[0].startswith('#'):
+            continue
+        if tokens[0] not in type_positions:
+            types.append(_element_type(tokens[0]))
+            type_positions[tokens[0]] = len(types) - 1
+            values.append([])
+        type_id: int = type_positions[tokens[0]]
+        if len(tokens) - 1 != len(fields(types[type_id])):
+            raise CircuitFormatError('line {}: {} expects {} values'.format(line_number, tokens[0],
+                                                                            len(fields(types[type_id]))))
+        values[type_id].append([float(token) for token in tokens[1:]])
+        type_ids.append(type_id)
+
+    value_arrays: List[np.ndarray] = [np.array(v, dtype=float).reshape(-1, len(fields(t)))
+                                      for t, v in zip(types, values)]
+    store: ElementStore = ElementStore.from_columns(types, value_arrays, np.array(type_ids, dtype=np.int8))
+    return Circuit.from_store(store, _bbox_from_array(_store_bbox(store)))
+
+
+def _store_bbox(store: ElementStore) -> np.ndarray:
+    if not store.size:
+        return np.full(4, np.nan)
+    boxes: List[np.ndarray] = [element_type.bounding_boxes(store.type_values(type_id))
+                               for type_id, element_type in enumerate(store.element_types) if store.counts[type_id]]
+    lower: np.ndarray = np.min([b[:, :2].min(axis=0) for b in boxes], axis=0)
+    upper: np.ndarray = np.max([b[:, 2:].max(axis=0) for b in boxes], axis=0)
+    return np.concatenate([lower, upper])
+
+
+def write_binary(circuit: Circuit, file: BinaryIO) -> None:
+    store: ElementStore = circuit.elements
+    n_types: int = len(store.element_types)
+    header: np.ndarray = np.zeros(1, dtype=binary_header_dtype)
+    table: np.ndarray = np.zeros(n_types, dtype=type_record_dtype)
+
+    offset: int = _aligned(binary_header_dtype.itemsize + n_types * type_record_dtype.itemsize)
+    header['type_ids_offset'] = offset
+    offset = _aligned(offset + store.size)
+    header['rows_offset'] = offset
+    offset += 8 * store.size
+    for type_id, element_type in enumerate(store.element_types):
+        table[type_id]['name'] = element_type.__name__.encode()
+        table[type_id]['n_fields'] = len(fields(element_type))
+        table[type_id]['count'] = store.counts[type_id]
+        table[type_id]['values_offset'] = offset
+        offset += 8 * store.counts[type_id] * len(fields(element_type))
+
+    header['magic'] = binary_magic
+    header['version'] = binary_version
+    header['n_types'] = n_types
+    header['n_elements'] = store.size
+    header['bbox'] = _store_bbox(store) if circuit.bbox is None else \
+        [circuit.bbox[0][0], circuit.bbox[0][1], circuit.bbox[1][0], circuit.bbox[1][1]]
+
+    sections: List[Tuple[int, bytes]] = [
+        (0, header.tobytes() + table.tobytes()),
+        (int(header['type_ids_offset'][0]), store.type_ids[:store.size].astype('<i1').tobytes()),
+        (int(header['rows_offset'][0]), store.rows[:store.size].astype('<i8').tobytes())]
+    sections += [(int(record['values_offset']), store.type_values(type_id).astype('<f8').tobytes())
+                 for type_id, record in enumerate(table)]
+    written: int = 0
+    for section_offset, section in sections:
+        file.write(b'\x00' * (section_offset - written))
+        file.write(section)
+        written = section_offset + len(section)
+
+
+def _section(data: np.ndarray, offset: int, length: int, name: str) -> np.ndarray:
+    # the bytes of a section, checked against the file size before anything is viewed in them
+    if offset + length > len(data):
+        raise CircuitFormatError('truncated binary circuit file: {} needs bytes {} to {} of {}'.format(
+            name, offset, offset + length, len(data)))
+    return data[offset:offset + length]
+
+
+def read_binary(path: str, mmap: bool = True) -> Circuit:
+    # mapped columns stay backed by the file, elements are only read when they are used
+    data: np.ndarray = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    if len(data) < binary_header_dtype.itemsize:
+        raise CircuitFormatError('not a binary circuit file')
+    header: np.void = data[:binary_header_dtype.itemsize].view(binary_header_dtype)[0]
+    if header['magic'] != binary_magic:
+        raise CircuitFormatError('not a binary circuit file')
+    if header['version'] != binary_version:
+        raise CircuitFormatError('unsupported binary circuit version {}'.format(header['version']))
+
+    n_types: int = int(header['n_types'])
+    n_elements: int = int(header['n_elements'])
+    table: np.ndarray = _section(data, binary_header_dtype.itemsize, n_types * type_record_dtype.itemsize,
+                                 'type table').view(type_record_dtype)
+    types: List[Type[CircuitElement]] = []
+    values: List[np.ndarray] = []
+    for record in table:
+        types.append(_element_type(record['name'].decode()))
+        if record['n_fields'] != len(fields(types[-1])):
+            raise CircuitFormatError('{} expects {} values'.format(types[-1].__name__, len(fields(types[-1]))))
+        values.append(_section(data, int(record['values_offset']), 8 * int(record['count']) * int(record['n_fields']),
+                               types[-1].__name__ + ' values').view('<f8').reshape(-1, int(record['n_fields'])))
+
+    if sum(int(record['count']) for record in table) != n_elements:
+        raise CircuitFormatError('type table counts do not add up to {} elements'.format(n_elements))
+    type_ids: np.ndarray = _section(data, int(header['type_ids_offset']), n_elements, 'type ids').view(np.int8)
+    rows: np.ndarray = _section(data, int(header['rows_offset']), 8 * n_elements, 'rows').view('<i8')
+    store: ElementStore = ElementStore.from_columns(types, values, type_ids, rows)
+    return Circuit.from_store(store, _bbox_from_array(header['bbox']))
+
+
+def save(circuit: Circuit, path: str, binary: bool = True) -> None:
+    if binary:
+        with open(path, 'wb') as file:
+            write_binary(circuit, file)
+    else:
+        with open(path, 'w') as file:
+            write_text(circuit, file)
+
+
+def load(path: str, mmap: bool = True) -> Circuit:
+    # the format is recognized by the first bytes
+    with open(path, 'rb') as file:
+        is_binary: bool = file.read(len(binary_magic)) == binary_magic
+    if is_binary:
+        return read_binary(path, mmap)
+    with open(path) as file:
+        return read_text(file)
+
+
+def same_circuit(c0: Circuit, c1: Circuit) -> bool:
+    s0: ElementStore = c0.elements
+    s1: ElementStore = c1.elements
+    if s0.size != s1.size or c0.bbox != c1.bbox:
+        return False
+    names0: List[str] = [t.__name__ for t in s0.element_types]
+    names1: List[str] = [t.__name__ for t in s1.element_types]
+    order1: Dict[str, int] = {name: type_id for type_id, name in enumerate(names1)}
+    if sorted(names0) != sorted(names1):
+        return False
+    remap: np.ndarray = np.array([order1[name] for name in names0], dtype=np.int8)
+    return bool((remap[s0.type_ids[:s0.size]] == s1.type_ids[:s1.size]).all() and
+                (s0.rows[:s0.size] == s1.rows[:s1.size]).all() and
+                all(np.array_equal(s0.type_values(type_id), s1.type_values(order1[name]))
+                    for type_id, name in enumerate(names0)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='round trip and loading time check of the circuit file formats')
+    parser.add_argument('--elements', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--path', default=None, help='stem of the check files, a temporary directory by default')
+    args = parser.parse_args()
+
+    from circuit_scheme import Contact, Grounding
+
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    circuit: Circuit = Circuit([Contact(0, 1000), Grounding(1000, 0)])
+    kinds: np.ndarray = rng.random(args.elements) < 0.5
+    for start in range(0, args.elements, 1000):
+        for is_contact in np.split(kinds[start:start + 1000], np.flatnonzero(np.diff(kinds[start:start + 1000])) + 1):
+            circuit.add_many(Contact if is_contact[0] else Grounding, rng.uniform(-1e6, 1e6, (len(is_contact), 2)))
+
+    check_dir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+    check_stem: str = os.path.join(check_dir.name, 'circuit_format_check') if args.path is None else args.path
+    for binary in (False, True):
+        check_path: str = check_stem + ('.bin' if binary else '.txt')
+        start_time: float = time.time()
+        save(circuit, check_path, binary)
+        save_time: float = time.time() - start_time
+        start_time = time.time()
+        loaded: Circuit = load(check_path)
+        load_time: float = time.time() - start_time
+        assert same_circuit(circuit, loaded), 'round trip failed for ' + check_path
+        assert loaded.elements[0] == Contact(0, 1000) and loaded.elements[1] == Grounding(1000, 0)
+        assert loaded.render_region(((-3000, -3000), (3000, 3000)), (300, 300)).tobytes() == \
+            circuit.render_region(((-3000, -3000), (3000, 3000)), (300, 300)).tobytes()
+        print('binary' if binary else 'text', len(loaded.elements), 'elements', 'saved in', save_time, 's',
+              'loaded in', load_time, 's')
+    check_dir.cleanup()
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
-from typing import Tuple, List, Union, BinaryIO
-from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, Sequence, Tuple, List, Optional, Type, Union, BinaryIO
+from array import array
+from dataclasses import dataclass, field, fields
 from PIL import Image, ImageDraw
 from abc import ABC, abstractmethod
 from enum import Enum
+import functools
+import math
+import time
+
+import numpy as np
+
+from svg_backend import SvgDraw
+import render_stats
 
 
 RealCoord = float
@@ -19,6 +28,32 @@ contact_size: int = 50
 grounding_width: int = 100
 grounding_height: int = 60
 line_width: int = 6
+# fixed palette for images rendered in 'P' mode, shared by all frames so no quantization is needed
+palette: List[Color] = [background_color, line_color]
+# side of the square cells of the spatial index of a circuit, in scheme coordinates
+index_cell_size: RealCoord = 1000.0
+# elements covering more cells are not bucketed but checked on every query
+index_max_cells_per_element: int = 64
+
+
+def create_image(image_size: Tuple[int, int], mode: str = 'RGB', colors: Iterable[Color] = ()) -> Image.Image:
+    # colors: drawn with besides those of palette, 'P' images get all of them up front so that every image has the
+    # same palette, rather than Pillow appending colors in the order they are drawn
+    if mode != 'P':
+        return Image.new(mode, image_size, background_color)
+    image: Image.Image = Image.new('P', image_size, 0)
+    image_palette: List[Color] = list(palette)
+    for color in colors:
+        if tuple(color) not in image_palette:
+            image_palette.append(tuple(color))
+    image.putpalette([channel for color in image_palette for channel in color])
+    return image
+
+
+def clear_image(image: Image.Image) -> Image.Image:
+    # brings a reused image back to what create_image gives
+    image.paste(0 if image.mode == 'P' else background_color, (0, 0) + image.size)
+    return image
 
 
 def unite_bounding_boxes(boxes: List[BoundBox]) -> BoundBox:
@@ -31,6 +66,45 @@ def unite_bounding_boxes(boxes: List[BoundBox]) -> BoundBox:
     return box
 
 
+@dataclass(frozen=True)
+class RenderQuality:
+    # draft renders: a fraction of the full resolution, with fixed pixel sizes and line widths scaled alike,
+    # plain line joints, contacts as boxes and symbols smaller than min_symbol_pixels left out
+    scale: float = 1.0
+    curved_joints: bool = True
+    contact_boxes: bool = False
+    min_symbol_pixels: float = 0.0
+
+    def size(self, image_size: Tuple[int, int]) -> Tuple[int, int]:
+        return max(1, int(image_size[0] * self.scale)), max(1, int(image_size[1] * self.scale))
+
+    def width(self, full_width: int) -> int:
+        return max(1, round(full_width * self.scale))
+
+
+full_quality: RenderQuality = RenderQuality()
+quality_levels: Dict[str, RenderQuality] = {
+    'full': full_quality,
+    'draft': RenderQuality(0.5, False, True, 4.0),
+    'sketch': RenderQuality(0.25, False, True, 8.0),
+}
+
+
+def _grown(values: np.ndarray, size: int) -> np.ndarray:
+    # capacity at least doubles, so appending row by row is amortized constant time
+    if size <= len(values):
+        return values
+    grown: np.ndarray = np.empty((max(size, 2 * len(values)),) + values.shape[1:], dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+def ordered_box(p0: Tuple[RealCoord, RealCoord], p1: Tuple[RealCoord, RealCoord]) \
+        -> List[Tuple[RealCoord, RealCoord]]:
+    # reversed axes swap the corners, Pillow wants the top left one first
+    return [(min(p0[0], p1[0]), min(p0[1], p1[1])), (max(p0[0], p1[0]), max(p0[1], p1[1]))]
+
+
 @dataclass(frozen=True)
 class AxisTransform:
     class ReverseState(Enum):
@@ -52,6 +126,11 @@ class AxisTransform:
     def xy(self, x_old: RealCoord, y_old: RealCoord) -> Tuple[RealCoord, RealCoord]:
         return self.x(x_old), self.y(y_old)
 
+    def xy_array(self, x_old: np.ndarray, y_old: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # same operations in the same order as x and y, so the results are bit-identical
+        return x_old * self.scale * self.x_reversed.value + self.x_shift, \
+            y_old * self.scale * self.y_reversed.value + self.y_shift
+
     @classmethod
     def build(cls, bbox: BoundBox, image_size: Tuple[int, int]) -> AxisTransform:
         scale: float = min(image_size[0] / (bbox[1][0] - bbox[0][0]), image_size[1] / (bbox[1][1] - bbox[0][1]))
@@ -60,6 +139,10 @@ class AxisTransform:
         return AxisTransform(scale, x_shift, y_shift)
 
 
+# Besides the object interface, element classes work on arrays holding many elements at once:
+# one row per element and one column per dataclass field. The array methods default to going through one object per
+# row, element classes override them to work on whole arrays.
+
 @dataclass
 class CircuitElement(ABC):
     @abstractmethod
@@ -70,6 +153,28 @@ class CircuitElement(ABC):
     def bounding_box(self) -> BoundBox:
         pass
 
+    def values(self) -> List[RealCoord]:
+        return [getattr(self, f.name) for f in fields(self)]
+
+    @classmethod
+    def bounding_boxes(cls, values: np.ndarray) -> np.ndarray:
+        # rows (x0, y0, x1, y1)
+        boxes: List[BoundBox] = [cls(*row).bounding_box() for row in values.tolist()]
+        return np.array([box[0] + box[1] for box in boxes], dtype=float).reshape(-1, 4)
+
+    @classmethod
+    def geometry(cls, tr: AxisTransform, values: np.ndarray,
+                 quality: RenderQuality = full_quality) -> Optional[np.ndarray]:
+        # rows of image coordinates, None draws the elements one by one with draw
+        # Classes returning rows also define draw_geometry(image_draw, row, quality), a staticmethod drawing one
+        # row, which ElementStore.draw calls instead of draw.
+        return None
+
+    @classmethod
+    def symbol_pixels(cls, tr: AxisTransform, quality: RenderQuality = full_quality) -> float:
+        # the larger side of the symbol in the image, classes of unknown size are never left out of drafts
+        return math.inf
+
 
 @dataclass
 class Contact(CircuitElement):
@@ -80,17 +185,43 @@ class Contact(CircuitElement):
         return self.x, self.y
 
     def draw(self, image_draw: ImageDraw.Draw, tr: AxisTransform = AxisTransform()) -> None:
-        image_draw.ellipse([tr.xy(self.x - contact_size / 2, self.y - contact_size / 2),
-                            tr.xy(self.x + contact_size / 2, self.y + contact_size / 2)],
-                           outline=line_color, fill=background_color, width=line_width)
-        image_draw.line([tr.xy(self.x - contact_size / 2, self.y - contact_size / 2),
-                         tr.xy(self.x + contact_size / 2, self.y + contact_size / 2)],
-                        fill=line_color, width=line_width)
+        self.draw_geometry(image_draw, self._geometry(tr, self.x, self.y))
 
     def bounding_box(self) -> BoundBox:
         return (self.x - contact_size / 2, self.y - contact_size / 2), \
                (self.x + contact_size / 2, self.y + contact_size / 2)
 
+    @classmethod
+    def bounding_boxes(cls, values: np.ndarray) -> np.ndarray:
+        return np.stack([values[:, 0] - contact_size / 2, values[:, 1] - contact_size / 2,
+                         values[:, 0] + contact_size / 2, values[:, 1] + contact_size / 2], axis=1)
+
+    @staticmethod
+    def _geometry(tr: AxisTransform, x, y, quality: RenderQuality = full_quality) -> List:
+        # the symbol scales with the scheme, x and y are numbers or arrays
+        x0, y0 = tr.xy_array(x - contact_size / 2, y - contact_size / 2)
+        x1, y1 = tr.xy_array(x + contact_size / 2, y + contact_size / 2)
+        return [x0, y0, x1, y1]
+
+    @classmethod
+    def geometry(cls, tr: AxisTransform, values: np.ndarray, quality: RenderQuality = full_quality) -> np.ndarray:
+        return np.stack(cls._geometry(tr, values[:, 0], values[:, 1], quality), axis=1)
+
+    @staticmethod
+    def draw_geometry(image_draw: ImageDraw.Draw, geometry: List[RealCoord],
+                      quality: RenderQuality = full_quality) -> None:
+        x0, y0, x1, y1 = geometry
+        if quality.contact_boxes:
+            image_draw.rectangle(ordered_box((x0, y0), (x1, y1)), outline=line_color, width=quality.width(line_width))
+            return
+        image_draw.ellipse(ordered_box((x0, y0), (x1, y1)), outline=line_color, fill=background_color,
+                           width=quality.width(line_width))
+        image_draw.line([(x0, y0), (x1, y1)], fill=line_color, width=quality.width(line_width))
+
+    @classmethod
+    def symbol_pixels(cls, tr: AxisTransform, quality: RenderQuality = full_quality) -> float:
+        return contact_size * tr.scale
+
 
 @dataclass
 class Grounding(CircuitElement):
@@ -101,50 +232,540 @@ class Grounding(CircuitElement):
         return self.x, self.y
 
     def draw(self, image_draw: ImageDraw.Draw, tr: AxisTransform = AxisTransform()) -> None:
-        cc: Tuple[RealCoord, RealCoord] = tr.xy(self.x, self.y)
-        image_draw.line([cc, (cc[0], cc[1] + grounding_height / 3)],
-                        fill=line_color, width=line_width)
-        image_draw.line([(cc[0] - grounding_width / 2, cc[1] + grounding_height / 3),
-                         (cc[0] + grounding_width / 2, cc[1] + grounding_height / 3)],
-                        fill=line_color, width=line_width)
-        image_draw.line([(cc[0] - grounding_width / 3, cc[1] + grounding_height / 3 * 2),
-                         (cc[0] + grounding_width / 3, cc[1] + grounding_height / 3 * 2)],
-                        fill=line_color, width=line_width)
-        image_draw.line([(cc[0] - grounding_width / 6, cc[1] + grounding_height),
-                         (cc[0] + grounding_width / 6, cc[1] + grounding_height)],
-                        fill=line_color, width=line_width)
+        self.draw_geometry(image_draw, self._geometry(tr, self.x, self.y))
 
     def bounding_box(self) -> BoundBox:
         return (self.x - grounding_width / 2, self.y), \
                (self.x + grounding_width / 2, self.y + grounding_height)
 
+    @classmethod
+    def bounding_boxes(cls, values: np.ndarray) -> np.ndarray:
+        return np.stack([values[:, 0] - grounding_width / 2, values[:, 1],
+                         values[:, 0] + grounding_width / 2, values[:, 1] + grounding_height], axis=1)
+
+    @staticmethod
+    def _geometry(tr: AxisTransform, x, y, quality: RenderQuality = full_quality) -> List:
+        # the symbol has a fixed size in pixels at full quality, the end points of its four strokes
+        # x and y are numbers or arrays
+        x, y = tr.xy_array(x, y)
+        width: float = grounding_width * quality.scale
+        height: float = grounding_height * quality.scale
+        y1, y2, y3 = y + height / 3, y + height / 3 * 2, y + height
+        return [x, y, x, y1,
+                x - width / 2, y1, x + width / 2, y1,
+                x - width / 3, y2, x + width / 3, y2,
+                x - width / 6, y3, x + width / 6, y3]
+
+    @classmethod
+    def geometry(cls, tr: AxisTransform, values: np.ndarray, quality: RenderQuality = full_quality) -> np.ndarray:
+        return np.stack(cls._geometry(tr, values[:, 0], values[:, 1], quality), axis=1)
+
+    @staticmethod
+    def draw_geometry(image_draw: ImageDraw.Draw, geometry: List[RealCoord],
+                      quality: RenderQuality = full_quality) -> None:
+        for i in range(0, len(geometry), 4):
+            image_draw.line([(geometry[i], geometry[i + 1]), (geometry[i + 2], geometry[i + 3])],
+                            fill=line_color, width=quality.width(line_width))
+
+    @classmethod
+    def symbol_pixels(cls, tr: AxisTransform, quality: RenderQuality = full_quality) -> float:
+        # measured on the strokes as drawn with tr, which keep their size in pixels at any scale of tr
+        geometry: List[RealCoord] = cls._geometry(tr, 0.0, 0.0, quality)
+        return max(max(geometry[0::2]) - min(geometry[0::2]), max(geometry[1::2]) - min(geometry[1::2]))
+
+
+# element classes by name, for reading schemes back from files
+element_types: Dict[str, Type[CircuitElement]] = {element_type.__name__: element_type
+                                                  for element_type in (Contact, Grounding)}
+
+
+def _integral(values: Iterable) -> bool:
+    return all(isinstance(value, int) for value in values)
+
+
+class _StoredElement:
+    # mixed into the element classes for the objects an ElementStore hands out, which write changes of their fields
+    # back to the store; they compare equal to, copy and pickle as plain elements
+    # The objects are created as plain elements and given their class afterwards, which needs the same layout.
+    __slots__ = ()
+    _store: ElementStore
+    _index: int
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        # copies made with dataclasses.replace get the class but no store
+        if name in self.__dataclass_fields__ and '_store' in self.__dict__:
+            self._store.write_back(self._index, self)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self) and type(other) is not type(self).__bases__[0]:
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __reduce__(self) -> Tuple[Type[CircuitElement], Tuple]:
+        return type(self).__bases__[0], tuple(self.values())
+
+
+# the _StoredElement class of every element class
+_stored_types: Dict[Type[CircuitElement], Type[CircuitElement]] = {}
+
+
+def _stored_type(element_type: Type[CircuitElement]) -> Type[CircuitElement]:
+    if element_type not in _stored_types:
+        # __eq__ ahead of the one dataclass gives the element class
+        _stored_types[element_type] = type(element_type.__name__, (element_type, _StoredElement),
+                                           {'__slots__': (), '__eq__': _StoredElement.__eq__,
+                                            '__qualname__': element_type.__qualname__,
+                                            '__module__': element_type.__module__})
+    return _stored_types[element_type]
+
+
+@dataclass(eq=False)
+class ElementStore:
+    # elements grouped by class into contiguous arrays of field values instead of one object per element,
+    # objects are only created when elements are accessed one by one
+    # It behaves like the list of elements it replaces: it compares equal to the same elements, can be indexed,
+    # sliced, iterated and appended to, and hands out the same object for an element every time, with changes to
+    # its fields written back to the arrays. Added elements are copied in. Elements with int fields get int fields
+    # back.
+    element_types: List[Type[CircuitElement]] = field(default_factory=list)
+    values: List[np.ndarray] = field(default_factory=list)
+    counts: List[int] = field(default_factory=list)
+    # class and row of every element in insertion order
+    type_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int8))
+    rows: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    size: int = 0
+    # elements whose fields were all ints, in insertion order
+    integral: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=bool))
+    # counts changes of stored elements, not appends, so that users of the arrays know to recompute what they derived
+    version: int = 0
+    # element objects handed out so far by insertion index, None for the others, and how many there are
+    objects: List[Optional[CircuitElement]] = field(default_factory=list, repr=False)
+    n_objects: int = field(default=0, repr=False)
+
+    @classmethod
+    def from_columns(cls, element_types: List[Type[CircuitElement]], values: List[np.ndarray],
+                     type_ids: np.ndarray, rows: Optional[np.ndarray] = None) -> ElementStore:
+        # the arrays are used as they are, so they can be read-only views of a mapped file:
+        # adding or changing elements copies them into new arrays first
+        if rows is None:
+            rows = np.empty(len(type_ids), dtype=np.int64)
+            for type_id in range(len(element_types)):
+                selected: np.ndarray = type_ids == type_id
+                rows[selected] = np.arange(np.count_nonzero(selected))
+        return cls(list(element_types), list(values), [len(v) for v in values], type_ids, rows, len(type_ids),
+                   np.zeros(len(type_ids), dtype=bool))
+
+    def __getstate__(self) -> Dict:
+        state: Dict = dict(self.__dict__)
+        del state['objects'], state['n_objects']
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.objects = []
+        self.n_objects = 0
+
+    def _type_id(self, element_type: Type[CircuitElement]) -> int:
+        if element_type not in self.element_types:
+            self.element_types.append(element_type)
+            self.values.append(np.empty((0, len(fields(element_type)))))
+            self.counts.append(0)
+        return self.element_types.index(element_type)
+
+    def add_many(self, element_type: Type[CircuitElement], values: np.ndarray, integral: bool = False) -> None:
+        type_id: int = self._type_id(element_type)
+        count: int = self.counts[type_id]
+        n: int = len(values)
+        self.values[type_id] = _grown(self.values[type_id], count + n)
+        self.values[type_id][count:count + n] = values
+        self.counts[type_id] += n
+        self.type_ids = _grown(self.type_ids, self.size + n)
+        self.type_ids[self.size:self.size + n] = type_id
+        self.rows = _grown(self.rows, self.size + n)
+        self.rows[self.size:self.size + n] = np.arange(count, count + n)
+        self.integral = _grown(self.integral, self.size + n)
+        self.integral[self.size:self.size + n] = integral
+        self.size += n
+
+    def add(self, element: CircuitElement) -> None:
+        type_id: int = self._type_id(type(element))
+        count: int = self.counts[type_id]
+        values: List[RealCoord] = element.values()
+        self.values[type_id] = _grown(self.values[type_id], count + 1)
+        self.values[type_id][count] = values
+        self.counts[type_id] += 1
+        self.type_ids = _grown(self.type_ids, self.size + 1)
+        self.type_ids[self.size] = type_id
+        self.rows = _grown(self.rows, self.size + 1)
+        self.rows[self.size] = count
+        self.integral = _grown(self.integral, self.size + 1)
+        self.integral[self.size] = _integral(values)
+        self.size += 1
+
+    append = add
+
+    def write_back(self, idx: int, element: CircuitElement) -> None:
+        type_id: int = int(self.type_ids[idx])
+        values: List[RealCoord] = element.values()
+        if not self.values[type_id].flags.writeable:
+            self.values[type_id] = self.values[type_id].copy()
+        if not self.integral.flags.writeable:
+            self.integral = self.integral.copy()
+        self.values[type_id][self.rows[idx]] = values
+        self.integral[idx] = _integral(values)
+        self.version += 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, idx: Union[int, slice]) -> Union[CircuitElement, List[CircuitElement]]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.size))]
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('element index out of range')
+        if idx >= len(self.objects) or self.objects[idx] is None:
+            self._hand_out(idx, idx + 1)
+        return self.objects[idx]
+
+    def __iter__(self) -> Iterator[CircuitElement]:
+        if self.n_objects < self.size:
+            self._hand_out(0, self.size)
+        return iter(self.objects)
+
+    def _hand_out(self, start: int, stop: int) -> None:
+        # creates the objects of the elements from start to stop that have none yet
+        objects: List[Optional[CircuitElement]] = self.objects
+        objects.extend([None] * (self.size - len(objects)))
+        type_ids: np.ndarray = self.type_ids[start:stop]
+        rows: np.ndarray = self.rows[start:stop]
+        values: List[Optional[List[RealCoord]]] = [None] * (stop - start)
+        for type_id in range(len(self.element_types)):
+            selected: np.ndarray = np.flatnonzero(type_ids == type_id)
+            for i, row in zip(selected.tolist(), self.values[type_id][rows[selected]].tolist()):
+                values[i] = row
+        element_types: List[Type[CircuitElement]] = self.element_types
+        stored_types: List[Type[CircuitElement]] = [_stored_type(element_type) for element_type in element_types]
+        for idx, type_id, row, integral in zip(range(start, stop), type_ids.tolist(), values,
+                                               self.integral[start:stop].tolist()):
+            if objects[idx] is not None:
+                continue
+            if integral:
+                row = [int(value) for value in row]
+            element: CircuitElement = element_types[type_id](*row)
+            element.__dict__['_store'] = self
+            element.__dict__['_index'] = idx
+            element.__class__ = stored_types[type_id]
+            objects[idx] = element
+            self.n_objects += 1
+
+    def __eq__(self, other) -> bool:
+        # equal to a store or list of equal elements in the same order
+        if not isinstance(other, (ElementStore, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def type_values(self, type_id: int) -> np.ndarray:
+        return self.values[type_id][:self.counts[type_id]]
+
+    def bounding_boxes(self, start: int = 0) -> np.ndarray:
+        # rows (x0, y0, x1, y1) of the elements from start on, in insertion order
+        boxes: np.ndarray = np.empty((self.size - start, 4))
+        type_ids: np.ndarray = self.type_ids[start:self.size]
+        for type_id, element_type in enumerate(self.element_types):
+            selected: np.ndarray = type_ids == type_id
+            boxes[selected] = element_type.bounding_boxes(self.values[type_id][self.rows[start:self.size][selected]])
+        return boxes
+
+    def draw(self, image_draw: ImageDraw.Draw, tr: AxisTransform, indices: np.ndarray,
+             quality: RenderQuality = full_quality) -> None:
+        # geometry of every class is transformed in bulk, elements are then drawn in insertion order
+        type_ids: np.ndarray = self.type_ids[indices]
+        rows: np.ndarray = self.rows[indices]
+        too_small: List[int] = [type_id for type_id, element_type in enumerate(self.element_types)
+                                if element_type.symbol_pixels(tr, quality) < quality.min_symbol_pixels]
+        if too_small:
+            kept: np.ndarray = ~np.isin(type_ids, too_small)
+            type_ids, rows = type_ids[kept], rows[kept]
+        geometry: List[List[List[RealCoord]]] = []
+        draw_geometry: List[Callable[[ImageDraw.Draw, List[RealCoord]], None]] = []
+        for type_id, element_type in enumerate(self.element_types):
+            type_rows: np.ndarray = rows[type_ids == type_id]
+            with render_stats.timed('geometry', element_type.__name__, items=len(type_rows)):
+                type_geometry: Optional[np.ndarray] = element_type.geometry(tr, self.values[type_id][type_rows],
+                                                                            quality)
+            if type_geometry is None:
+                # classes without bulk geometry draw themselves from their field values
+                geometry.append(self.values[type_id][type_rows].tolist())
+                draw_geometry.append(lambda image_draw, values, element_type=element_type:
+                                     element_type(*values).draw(image_draw, tr))
+                continue
+            geometry.append(type_geometry.tolist())
+            draw_geometry.append(element_type.draw_geometry if quality == full_quality else
+                                 functools.partial(element_type.draw_geometry, quality=quality))
+        next_row: List[int] = [0] * len(self.element_types)
+        if render_stats.stats is None:
+            for type_id in type_ids.tolist():
+                draw_geometry[type_id](image_draw, geometry[type_id][next_row[type_id]])
+                next_row[type_id] += 1
+            return
+
+        seconds: List[float] = [0.0] * len(self.element_types)
+        for type_id in type_ids.tolist():
+            start: float = time.perf_counter()
+            draw_geometry[type_id](image_draw, geometry[type_id][next_row[type_id]])
+            seconds[type_id] += time.perf_counter() - start
+            next_row[type_id] += 1
+        for type_id, element_type in enumerate(self.element_types):
+            if next_row[type_id]:
+                render_stats.stats.add(('raster', element_type.__name__), seconds[type_id], next_row[type_id])
+
+
+def _cell_keys(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    # ordered like (cx, cy) for cell coordinates within 32 bits
+    return cx * (1 << 32) + (cy + (1 << 31))
+
+
+@dataclass
+class SpatialIndex:
+    # uniform grid over element bounding boxes, elements are identified by their insertion index
+    # Elements inside a single cell added in bulk are packed: their indices sorted by cell key, so a column of cells
+    # is one contiguous slice. Elements added one at a time, small batches and elements spanning several cells go to
+    # per-cell buckets.
+    cell_size: RealCoord = index_cell_size
+    # rows (x0, y0, x1, y1)
+    boxes: np.ndarray = field(default_factory=lambda: np.empty((0, 4)))
+    size: int = 0
+    packed_keys: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    packed_indices: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    packed_cells: int = 0
+    cells: Dict[Tuple[int, int], array] = field(default_factory=dict)
+    large: array = field(default_factory=lambda: array('q'))
+
+    def _insert_cells(self, idx: int, cx0: int, cy0: int, cx1: int, cy1: int) -> None:
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > index_max_cells_per_element:
+            self.large.append(idx)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket: Optional[array] = self.cells.get((cx, cy))
+                if bucket is None:
+                    bucket = self.cells[(cx, cy)] = array('q')
+                bucket.append(idx)
+
+    def insert(self, bbox: BoundBox) -> None:
+        self.boxes = _grown(self.boxes, self.size + 1)
+        self.boxes[self.size] = bbox[0] + bbox[1]
+        self._insert_cells(self.size, math.floor(bbox[0][0] / self.cell_size), math.floor(bbox[0][1] / self.cell_size),
+                           math.floor(bbox[1][0] / self.cell_size), math.floor(bbox[1][1] / self.cell_size))
+        self.size += 1
+
+    def insert_many(self, boxes: np.ndarray) -> None:
+        start: int = self.size
+        self.boxes = _grown(self.boxes, start + len(boxes))
+        self.boxes[start:start + len(boxes)] = boxes
+        self.size += len(boxes)
+        cell_ranges: np.ndarray = np.floor(boxes / self.cell_size).astype(np.int64)
+        widths: np.ndarray = cell_ranges[:, 2] - cell_ranges[:, 0] + 1
+        heights: np.ndarray = cell_ranges[:, 3] - cell_ranges[:, 1] + 1
+        n_cells: np.ndarray = widths * heights
+        large: np.ndarray = n_cells > index_max_cells_per_element
+        self.large.extend((np.flatnonzero(large) + start).tolist())
+        # repacking sorts everything packed so far, smaller batches are cheaper to put into buckets
+        if 8 * np.count_nonzero(~large) < len(self.packed_keys):
+            for idx, cell_range in zip((np.flatnonzero(~large) + start).tolist(), cell_ranges[~large].tolist()):
+                self._insert_cells(idx, *cell_range)
+            return
+
+        # one (cell, element) pair per covered cell
+        packed: np.ndarray = np.flatnonzero(~large)
+        repeats: np.ndarray = n_cells[packed]
+        pairs: np.ndarray = np.repeat(packed, repeats)
+        offsets: np.ndarray = np.arange(len(pairs)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        cx: np.ndarray = cell_ranges[pairs, 0] + offsets // heights[pairs]
+        cy: np.ndarray = cell_ranges[pairs, 1] + offsets % heights[pairs]
+        keys: np.ndarray = np.concatenate([self.packed_keys, _cell_keys(cx, cy)])
+        indices: np.ndarray = np.concatenate([self.packed_indices, pairs + start])
+        order: np.ndarray = np.argsort(keys, kind='stable')
+        self.packed_keys = keys[order]
+        self.packed_indices = indices[order]
+        self.packed_cells = int(np.count_nonzero(np.diff(self.packed_keys))) + 1
+
+    def query(self, bbox: BoundBox) -> np.ndarray:
+        # indices of the boxes intersecting bbox, in insertion order
+        cx0, cy0, cx1, cy1 = (math.floor(c / self.cell_size) for c in bbox[0] + bbox[1])
+        candidates: np.ndarray
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= len(self.cells) + self.packed_cells:
+            buckets: List[np.ndarray] = [np.frombuffer(self.cells[(cx, cy)], dtype=np.int64)
+                                         for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)
+                                         if (cx, cy) in self.cells] if self.cells else []
+            if len(self.packed_keys):
+                columns: np.ndarray = np.arange(cx0, cx1 + 1, dtype=np.int64)
+                lower: np.ndarray = np.searchsorted(self.packed_keys, _cell_keys(columns, cy0), 'left')
+                upper: np.ndarray = np.searchsorted(self.packed_keys, _cell_keys(columns, cy1), 'right')
+                buckets += [self.packed_indices[i:j] for i, j in zip(lower.tolist(), upper.tolist()) if i < j]
+            candidates = np.unique(np.concatenate(buckets + [np.frombuffer(self.large, dtype=np.int64)]))
+        else:
+            # the query covers more cells than are occupied, testing every box is cheaper
+            candidates = np.arange(self.size)
+        boxes: np.ndarray = self.boxes[candidates]
+        return candidates[(boxes[:, 0] <= bbox[1][0]) & (bbox[0][0] <= boxes[:, 2]) &
+                          (boxes[:, 1] <= bbox[1][1]) & (bbox[0][1] <= boxes[:, 3])]
+
+
+def _united(bbox: Optional[BoundBox], boxes: np.ndarray) -> Optional[BoundBox]:
+    # bbox grown by rows (x0, y0, x1, y1)
+    if not len(boxes):
+        return bbox
+    lower: List[RealCoord] = boxes[:, :2].min(axis=0).tolist()
+    upper: List[RealCoord] = boxes[:, 2:].max(axis=0).tolist()
+    if bbox is not None:
+        lower = [min(lower[0], bbox[0][0]), min(lower[1], bbox[0][1])]
+        upper = [max(upper[0], bbox[1][0]), max(upper[1], bbox[1][1])]
+    return (lower[0], lower[1]), (upper[0], upper[1])
+
 
 @dataclass
 class Circuit:
-    elements: List[CircuitElement] = field(default_factory=list)
+    # the elements are moved into an ElementStore, which can be indexed, iterated and appended to like the list
+    elements: Sequence[CircuitElement] = field(default_factory=list)
+    # built on first use when the elements were loaded as a whole
+    index: Optional[SpatialIndex] = field(default_factory=SpatialIndex, init=False, repr=False, compare=False)
+    _bbox: Optional[BoundBox] = field(default=None, init=False, repr=False, compare=False)
+    # number of elements and store version the index and bounding box were last brought up to date with,
+    # elements appended to the store directly or changed in place are caught up with on the next use
+    _indexed: int = field(default=0, init=False, repr=False, compare=False)
+    _version: int = field(default=0, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        elements: Sequence[CircuitElement] = self.elements
+        self.elements = ElementStore()
+        for element in elements:
+            self.add(element)
+
+    @classmethod
+    def from_store(cls, store: ElementStore, bbox: Optional[BoundBox]) -> Circuit:
+        circuit: Circuit = cls()
+        circuit.elements = store
+        circuit.index = None
+        circuit._bbox = bbox
+        circuit._indexed = len(store)
+        circuit._version = store.version
+        return circuit
+
+    def _sync(self) -> None:
+        if self._version != self.elements.version:
+            # elements changed in place, boxes can shrink as well as grow
+            self.index = None
+            self._bbox = _united(None, self.elements.bounding_boxes())
+        elif self._indexed < len(self.elements):
+            boxes: np.ndarray = self.elements.bounding_boxes(self._indexed)
+            if self.index is not None:
+                self.index.insert_many(boxes)
+            self._bbox = _united(self._bbox, boxes)
+        self._indexed = len(self.elements)
+        self._version = self.elements.version
+
+    @property
+    def bbox(self) -> Optional[BoundBox]:
+        self._sync()
+        return self._bbox
+
+    def spatial_index(self) -> SpatialIndex:
+        self._sync()
+        if self.index is None:
+            self.index = SpatialIndex()
+            self.index.insert_many(self.elements.bounding_boxes())
+        return self.index
 
     def add(self, element: CircuitElement) -> None:
-        self.elements.append(element)
+        box: BoundBox = element.bounding_box()
+        index: SpatialIndex = self.spatial_index()
+        self.elements.add(element)
+        index.insert(box)
+        self._indexed += 1
+        if self._bbox is None:
+            self._bbox = box
+        else:
+            self._bbox = (min(self._bbox[0][0], box[0][0]), min(self._bbox[0][1], box[0][1])), \
+                         (max(self._bbox[1][0], box[1][0]), max(self._bbox[1][1], box[1][1]))
+
+    def add_many(self, element_type: Type[CircuitElement], values: np.ndarray) -> None:
+        # values: one row of field values per element
+        integral: bool = np.issubdtype(np.asarray(values).dtype, np.integer)
+        values = np.asarray(values, dtype=float).reshape(-1, len(fields(element_type)))
+        if not len(values):
+            return
+        boxes: np.ndarray = element_type.bounding_boxes(values)
+        index: SpatialIndex = self.spatial_index()
+        self.elements.add_many(element_type, values, integral)
+        index.insert_many(boxes)
+        self._indexed += len(values)
+        self._bbox = _united(self._bbox, boxes)
+
+    def visible_elements(self, bbox: BoundBox) -> List[CircuitElement]:
+        return [self.elements[idx] for idx in self.spatial_index().query(bbox).tolist()]
+
+    def render_region(self, bbox: BoundBox, image_size: Tuple[int, int], mode: str = 'RGB',
+                      image: Optional[Image.Image] = None, quality: RenderQuality = full_quality) -> Image.Image:
+        # draws the part of the scheme inside bbox, only the elements that can reach the image are visited
+        # the image gets quality.size(image_size), an image of that size and mode can be passed in to be reused
+        image_size = quality.size(image_size)
+        if bbox[1][0] == bbox[0][0] or bbox[1][1] == bbox[0][1]:
+            return create_image(image_size, mode) if image is None else clear_image(image)
+        return self.render_view(AxisTransform.build(bbox, image_size), image_size, mode, image, quality)
+
+    def view_indices(self, tr: AxisTransform, image_size: Tuple[int, int]) -> np.ndarray:
+        # the elements that can reach an image of image_size drawn with tr (straight x, reversed y):
+        # symbols of fixed pixel size and thick lines reach beyond element bounding boxes
+        margin: RealCoord = (max(grounding_width, grounding_height, contact_size) + line_width) / tr.scale
+        x0: RealCoord = -tr.x_shift / tr.scale
+        y1: RealCoord = tr.y_shift / tr.scale
+        return self.spatial_index().query(((x0 - margin, y1 - image_size[1] / tr.scale - margin),
+                                           (x0 + image_size[0] / tr.scale + margin, y1 + margin)))
+
+    def view_elements(self, tr: AxisTransform, image_size: Tuple[int, int]) -> List[CircuitElement]:
+        return [self.elements[idx] for idx in self.view_indices(tr, image_size).tolist()]
+
+    def render_view(self, tr: AxisTransform, image_size: Tuple[int, int], mode: str = 'RGB',
+                    image: Optional[Image.Image] = None, quality: RenderQuality = full_quality) -> Image.Image:
+        # tr and image_size describe the image as drawn, quality only simplifies the drawing
+        image = create_image(image_size, mode) if image is None else clear_image(image)
+        self.elements.draw(ImageDraw.Draw(image), tr, self.view_indices(tr, image_size), quality)
+        return image
+
+    def save_png(self, image_size: Tuple[int, int], pf: Union[BinaryIO, str], mode: str = 'RGB',
+                 image: Optional[Image.Image] = None, quality: RenderQuality = full_quality) -> None:
+        if self.bbox is None:
+            return
+
+        bbox: BoundBox = self.bbox
+
+        if bbox[1][0] == bbox[0][0] or bbox[1][1] == bbox[0][1]:
+            return
 
-    def save_png(self, image_size: Tuple[int, int], pf: Union[BinaryIO, str]) -> None:
-        if not self.elements:
+        with render_stats.timed('save_png', 'render'):
+            image = self.render_region(bbox, image_size, mode, image, quality)
+        with render_stats.timed('save_png', 'encode'):
+            if isinstance(pf, str):
+                with open(pf, 'wb') as file:
+                    image.save(file, format='PNG')
+            else:
+                image.save(pf, format='PNG')
+
+    def save_svg(self, image_size: Tuple[int, int], pf: Union[BinaryIO, str]) -> None:
+        # the picture save_png gives, as vector elements in its pixel coordinates
+        if self.bbox is None:
             return
 
-        bbox: BoundBox = unite_bounding_boxes([element.bounding_box() for element in self.elements])
+        bbox: BoundBox = self.bbox
 
         if bbox[1][0] == bbox[0][0] or bbox[1][1] == bbox[0][1]:
             return
 
         tr: AxisTransform = AxisTransform.build(bbox, image_size)
-        image: Image = Image.new('RGB', image_size, background_color)
-        image_draw: ImageDraw = ImageDraw.Draw(image)
-        for element in self.elements:
-            element.draw(image_draw, tr)
-
-        file: BinaryIO = open(pf, 'wb') if isinstance(pf, str) else pf
-        image.save(pf, format='PNG')
-
-        print(tr)
-        print(bbox)
-        print(tr.xy(bbox[0][0], bbox[0][1]))
-        print(tr.xy(bbox[1][0], bbox[1][1]))
+        svg: SvgDraw = SvgDraw(image_size, background_color)
+        self.elements.draw(svg, tr, self.view_indices(tr, image_size))
+        svg.save(pf)
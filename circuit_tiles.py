@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
+from multiprocessing import Pool
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import time
+
+from circuit_scheme import AxisTransform, BoundBox, Circuit, CircuitElement, Contact, Grounding, line_width
+
+
+# Tile pyramid: level 0 is the coarsest, every next level doubles the scale up to the requested one at the last level.
+# Tile (tx, ty) of a level covers pixels [tx * tile_size, (tx + 1) * tile_size) x [ty * tile_size, ...) of the whole
+# scheme drawn at the scale of the level, with the top left corner of the scheme bounding box at pixel (0, 0).
+# Tiles are written as <output>/<level>/<tx>_<ty>.png, tiles without elements are not written. Tiles listed in the
+# manifest of the previous export that are not part of the new one are deleted.
+
+manifest_name: str = 'manifest.json'
+# Pillow clips thick lines at the image border differently from drawing them whole, so tiles are drawn with a border
+# of this many pixels and cropped, otherwise neighbouring tiles do not join seamlessly
+tile_bleed: int = line_width
+Tile = Tuple[int, int, int]
+
+
+@dataclass
+class TileReport:
+    rendered: int = 0
+    unchanged: int = 0
+    empty: int = 0
+    elapsed: float = 0.0
+
+
+def level_scale(scale: float, levels: int, level: int) -> float:
+    return scale / 2 ** (levels - 1 - level)
+
+
+def level_tiles(bbox: BoundBox, scale: float, tile_size: int) -> Tuple[int, int]:
+    return max(1, math.ceil((bbox[1][0] - bbox[0][0]) * scale / tile_size)), \
+           max(1, math.ceil((bbox[1][1] - bbox[0][1]) * scale / tile_size))
+
+
+def tile_transform(bbox: BoundBox, scale: float, tile_size: int, tx: float, ty: float) -> AxisTransform:
+    return AxisTransform(scale, -bbox[0][0] * scale - tx * tile_size, bbox[1][1] * scale - ty * tile_size)
+
+
+def tile_path(output: str, tile: Tile) -> str:
+    return os.path.join(output, str(tile[0]), '{}_{}.png'.format(tile[1], tile[2]))
+
+
+def _element_digest(element: CircuitElement) -> bytes:
+    return hashlib.sha1(repr(element).encode()).digest()
+
+
+# the circuit is sent to every worker once, jobs only carry tile coordinates
+_worker_circuit: Optional[Circuit] = None
+# digests of the elements seen by the worker, elements often fall into several tiles
+_worker_digests: Dict[int, bytes] = {}
+
+
+def _init_worker(circuit: Circuit) -> None:
+    global _worker_circuit, _worker_digests
+    _worker_circuit = circuit
+    _worker_digests = {}
+
+
+def _fingerprint_column(job: Tuple[int, int, BoundBox, float, int, int, str]) -> List[Tuple[Tile, Optional[str]]]:
+    # a tile has to be rendered again when its transform or any of its elements changed, None for empty tiles
+    level, tx, bbox, scale, levels, tile_size, mode = job
+    current_scale: float = level_scale(scale, levels, level)
+    _, n_y = level_tiles(bbox, current_scale, tile_size)
+    fingerprints: List[Tuple[Tile, Optional[str]]] = []
+    for ty in range(n_y):
+        tr: AxisTransform = tile_transform(bbox, current_scale, tile_size, tx, ty)
+        indices: List[int] = _worker_circuit.view_indices(tr, (tile_size, tile_size)).tolist()
+        if not indices:
+            fingerprints.append(((level, tx, ty), None))
+            continue
+        fingerprint = hashlib.sha1(repr((tr, tile_size, mode)).encode())
+        for idx in indices:
+            if idx not in _worker_digests:
+                _worker_digests[idx] = _element_digest(_worker_circuit.elements[idx])
+            fingerprint.update(_worker_digests[idx])
+        fingerprints.append(((level, tx, ty), fingerprint.hexdigest()))
+    return fingerprints
+
+
+def _render_tile(job: Tuple[Tile, str, BoundBox, float, int, int, str]) -> Tile:
+    tile, output, bbox, scale, levels, tile_size, mode = job
+    level, tx, ty = tile
+    tr: AxisTransform = tile_transform(bbox, level_scale(scale, levels, level), tile_size, tx - tile_bleed / tile_size,
+                                       ty - tile_bleed / tile_size)
+    path: str = tile_path(output, tile)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _worker_circuit.render_view(tr, (tile_size + 2 * tile_bleed, tile_size + 2 * tile_bleed), mode) \
+        .crop((tile_bleed, tile_bleed, tile_bleed + tile_size, tile_bleed + tile_size)).save(path, format='PNG')
+    return tile
+
+
+def _load_manifest(output: str) -> Dict[str, str]:
+    try:
+        with open(os.path.join(output, manifest_name)) as file:
+            return json.load(file)['tiles']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _tile_key(tile: Tile) -> str:
+    return '{}/{}_{}'.format(*tile)
+
+
+def export_tiles(circuit: Circuit, output: str, scale: float, levels: int = 1, tile_size: int = 256,
+                 mode: str = 'RGB', workers: Optional[int] = None) -> TileReport:
+    # every worker holds one tile image at a time, so memory does not depend on the size of the whole image
+    report: TileReport = TileReport()
+    start_time: float = time.time()
+    if circuit.bbox is None:
+        return report
+    bbox: BoundBox = circuit.bbox
+
+    previous: Dict[str, str] = _load_manifest(output)
+    tiles: Dict[str, str] = {}
+
+    def plan(columns: Iterator[List[Tuple[Tile, Optional[str]]]]) \
+            -> List[Tuple[Tile, str, BoundBox, float, int, int, str]]:
+        jobs: List[Tuple[Tile, str, BoundBox, float, int, int, str]] = []
+        for column in columns:
+            for tile, fingerprint in column:
+                path: str = tile_path(output, tile)
+                if fingerprint is None:
+                    report.empty += 1
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                tiles[_tile_key(tile)] = fingerprint
+                if previous.get(_tile_key(tile)) == fingerprint and os.path.exists(path):
+                    report.unchanged += 1
+                    continue
+                jobs.append((tile, output, bbox, scale, levels, tile_size, mode))
+        # tiles of an export with other levels, tile size or bounding box
+        for key in previous.keys() - tiles.keys():
+            stale: str = os.path.join(output, key + '.png')
+            if os.path.exists(stale):
+                os.remove(stale)
+        return jobs
+
+    # both the fingerprints and the tiles are computed by the workers, fingerprints a column of tiles per job
+    fingerprint_jobs: List[Tuple[int, int, BoundBox, float, int, int, str]] = [
+        (level, tx, bbox, scale, levels, tile_size, mode) for level in range(levels)
+        for tx in range(level_tiles(bbox, level_scale(scale, levels, level), tile_size)[0])]
+    if workers == 1:
+        _init_worker(circuit)
+        report.rendered = sum(1 for _ in map(_render_tile, plan(map(_fingerprint_column, fingerprint_jobs))))
+    else:
+        with Pool(workers, _init_worker, (circuit,)) as pool:
+            render_jobs: List[Tuple[Tile, str, BoundBox, float, int, int, str]] = plan(
+                pool.imap(_fingerprint_column, fingerprint_jobs))
+            report.rendered = sum(1 for _ in pool.imap_unordered(_render_tile, render_jobs))
+
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, manifest_name), 'w') as file:
+        json.dump({'bbox': bbox, 'scale': scale, 'levels': levels, 'tile_size': tile_size, 'mode': mode,
+                   'tiles': tiles}, file, indent=1)
+    report.elapsed = time.time() - start_time
+    return report
+
+
+def random_circuit(n_elements: int, extent: float, seed: int = 0) -> Circuit:
+    rng: random.Random = random.Random(seed)
+    circuit: Circuit = Circuit()
+    for _ in range(n_elements):
+        element_type = Contact if rng.random() < 0.5 else Grounding
+        circuit.add(element_type(rng.uniform(-extent, extent), rng.uniform(-extent, extent)))
+    return circuit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tiled export of a random circuit scheme')
+    parser.add_argument('output')
+    parser.add_argument('--elements', type=int, default=10000)
+    parser.add_argument('--extent', type=float, default=100000.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=0.1)
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    tile_report: TileReport = export_tiles(random_circuit(args.elements, args.extent, args.seed), args.output,
+                                           args.scale, args.levels, args.tile_size, workers=args.workers)
+    print('rendered', tile_report.rendered, 'unchanged', tile_report.unchanged, 'empty', tile_report.empty)
+    print('time elapsed', tile_report.elapsed, 's')
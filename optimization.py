@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import bisect
+import heapq
 import math
 import sys
 from dataclasses import dataclass
+from enum import Enum, IntEnum
 import random
 import time
 
+import numpy as np
+
 
 tolerance = 1e-12
 
@@ -42,6 +48,83 @@ class Constraint:
         return Constraint((random.uniform(-10, 10), random.uniform(-100, 0), 1000 + random.uniform(-100, 0)))
 
 
+@dataclass
+class ConstraintSet:
+    # columnar storage: constraint idx is slope[idx], lower[idx], upper[idx]
+    slope: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.slope)
+
+    def __getitem__(self, idx: int) -> Constraint:
+        return Constraint((float(self.slope[idx]), float(self.lower[idx]), float(self.upper[idx])))
+
+    def __iter__(self) -> Iterator[Constraint]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def as_array(self) -> np.ndarray:
+        return np.stack((self.slope, self.lower, self.upper), axis=-1)
+
+    def is_valid(self) -> bool:
+        return bool(np.all(self.lower <= self.upper))
+
+    def has_solutions(self) -> bool:
+        return bool(self.lower.max() <= self.upper.min())
+
+    def has_infinite_solutions(self) -> bool:
+        return bool(np.all(self.slope == self.slope[0])) if len(self) else True
+
+    def verify(self, s: float, dx: float) -> bool:
+        shifted: np.ndarray = self.slope * s + dx
+        return bool(np.all((self.upper + tolerance >= shifted) & (shifted >= self.lower - tolerance)))
+
+    def dx_interval(self, s: float) -> Tuple[float, float]:
+        if not len(self):
+            return -math.inf, math.inf
+        return float((-self.slope * s + self.lower).max()), float((-self.slope * s + self.upper).min())
+
+    @classmethod
+    def from_array(cls, data: np.ndarray) -> ConstraintSet:
+        data = np.asarray(data, dtype=np.float64).reshape(-1, 3)
+        return ConstraintSet(np.ascontiguousarray(data[:, 0]),
+                             np.ascontiguousarray(data[:, 1]),
+                             np.ascontiguousarray(data[:, 2]))
+
+    @classmethod
+    def from_constraints(cls, cons: Iterable[Constraint]) -> ConstraintSet:
+        return ConstraintSet.from_array(np.array([c.data for c in cons], dtype=np.float64))
+
+    @classmethod
+    def make_table(cls) -> ConstraintSet:
+        return ConstraintSet.from_constraints(generate_constraints_table())
+
+    @classmethod
+    def make_random(cls, n_constraints: int, rng: Optional[np.random.Generator] = None) -> ConstraintSet:
+        # by default follow the state of the random module, so random.seed() reproduces the set as well
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        return ConstraintSet(rng.uniform(-10, 10, n_constraints),
+                             rng.uniform(-100, 0, n_constraints),
+                             1000 + rng.uniform(-100, 0, n_constraints))
+
+
+Constraints = Union[List[Constraint], ConstraintSet]
+
+
+def generate_constraints_random_batch(n_instances: int, n_constraints: int,
+                                     rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    result: np.ndarray = np.empty((n_instances, n_constraints, 3))
+    result[:, :, 0] = rng.uniform(-10, 10, (n_instances, n_constraints))
+    result[:, :, 1] = rng.uniform(-100, 0, (n_instances, n_constraints))
+    result[:, :, 2] = 1000 + rng.uniform(-100, 0, (n_instances, n_constraints))
+    return result
+
+
 def generate_constraints_empty() -> List[Constraint]:
     return []
 
@@ -64,18 +147,24 @@ def generate_constraints_random(n_constraints: int) -> List[Constraint]:
     return result
 
 
-def all_valid_constraints(cons: List[Constraint]) -> bool:
+def all_valid_constraints(cons: Constraints) -> bool:
+    if isinstance(cons, ConstraintSet):
+        return cons.is_valid()
     for c in cons:
         if not c.is_valid():
             return False
     return True
 
 
-def has_solutions(cons: List[Constraint]) -> bool:
+def has_solutions(cons: Constraints) -> bool:
+    if isinstance(cons, ConstraintSet):
+        return cons.has_solutions()
     return max(cons, key=lambda c: c[1])[1] <= min(cons, key=lambda c: c[2])[2]
 
 
-def has_infinite_solutions(cons: List[Constraint]) -> bool:
+def has_infinite_solutions(cons: Constraints) -> bool:
+    if isinstance(cons, ConstraintSet):
+        return cons.has_infinite_solutions()
     all_the_same: bool = True
     for idx in range(1, len(cons)):
         if cons[idx][0] != cons[0][0]:
@@ -84,14 +173,18 @@ def has_infinite_solutions(cons: List[Constraint]) -> bool:
     return all_the_same
 
 
-def verify(cons: List[Constraint], s: float, dx: float) -> bool:
+def verify(cons: Constraints, s: float, dx: float) -> bool:
+    if isinstance(cons, ConstraintSet):
+        return cons.verify(s, dx)
     for c in cons:
         if not c.verify(s, dx):
             return False
     return True
 
 
-def dx_interval(cons: List[Constraint], s: float) -> Tuple[float, float]:
+def dx_interval(cons: Constraints, s: float) -> Tuple[float, float]:
+    if isinstance(cons, ConstraintSet):
+        return cons.dx_interval(s)
     interval: Tuple[float, float] = (-math.inf, math.inf)
     for c in cons:
         current_interval: Tuple[float, float] = c.dx_interval(s)
@@ -99,7 +192,33 @@ def dx_interval(cons: List[Constraint], s: float) -> Tuple[float, float]:
     return interval
 
 
-def solve(cons: List[Constraint]) -> Tuple[float, float]:
+def _pivot_columnar(slope: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> Tuple[int, int, float]:
+    # same pivoting as solve, each pivot scans all constraints at once
+    # returns the constraints whose lower and upper branches meet at the optimum and the optimal s
+    constraint_idx: int = int(np.argmax(lower))
+    while True:
+        slope_diff: np.ndarray = slope - slope[constraint_idx]
+        s_candidates: np.ndarray = np.where(slope_diff < 0, lower[constraint_idx] - lower, upper - lower[constraint_idx])
+        s_candidates[slope_diff == 0] = math.inf
+        with np.errstate(divide='ignore'):
+            s_candidates /= np.abs(slope_diff)
+        # argmin returns the first minimum, the same tie-breaking as the strict comparison in solve
+        constraint_idx_candidate: int = int(np.argmin(s_candidates))
+        s_current_max: float = float(s_candidates[constraint_idx_candidate])
+        if slope_diff[constraint_idx_candidate] > 0:
+            return constraint_idx, constraint_idx_candidate, s_current_max
+        constraint_idx = constraint_idx_candidate
+
+
+def _solve_columnar(cons: ConstraintSet) -> Tuple[float, float]:
+    _, upper_idx, s = _pivot_columnar(cons.slope, cons.lower, cons.upper)
+    return s, cons[upper_idx].dx_top_branch(s)
+
+
+def solve(cons: Constraints) -> Tuple[float, float]:
+    if isinstance(cons, ConstraintSet):
+        return _solve_columnar(cons)
+
     # find index of constraint with top lower branch
     # it corresponds to the widest circuit element
     constraint_idx, _ = max(enumerate(cons), key=lambda ic: ic[1][1])
@@ -138,38 +257,527 @@ def solve(cons: List[Constraint]) -> Tuple[float, float]:
     return s_current_max, dx
 
 
-def solve_and_test(cons: List[Constraint]) -> None:
+def _max_envelope(lines: List[Tuple[float, float, int]]) -> Tuple[List[Tuple[float, float, int]], List[float]]:
+    # upper hull of lines k * s + b, returns hull lines ordered by slope and the breakpoints between them
+    hull: List[Tuple[float, float, int]] = []
+    for line in sorted(lines):
+        k3, b3, _ = line
+        if hull and hull[-1][0] == k3:
+            hull.pop()
+        while len(hull) >= 2:
+            k1, b1, _ = hull[-2]
+            k2, b2, _ = hull[-1]
+            if (b1 - b3) * (k2 - k1) > (b1 - b2) * (k3 - k1):
+                break
+            hull.pop()
+        hull.append(line)
+    breaks: List[float] = [(hull[j][1] - hull[j + 1][1]) / (hull[j + 1][0] - hull[j][0]) for j in range(len(hull) - 1)]
+    return hull, breaks
+
+
+def _undominated(k: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # indices of the lines k * s + b that no other line reaches or exceeds at every s >= 0, the only ones that can
+    # be on the envelope there
+    order: np.ndarray = np.lexsort((-b, -k))
+    b_sorted: np.ndarray = b[order]
+    kept: np.ndarray = np.ones(len(order), dtype=bool)
+    kept[1:] = b_sorted[1:] > np.maximum.accumulate(b_sorted)[:-1]
+    return order[kept]
+
+
+def _rightmost_root(lower: List[Tuple[float, float, int]], lower_breaks: List[float],
+                    upper: List[Tuple[float, float, int]], upper_breaks: List[float], start: float = 0.0) \
+        -> Tuple[Tuple[float, float, int], Tuple[float, float, int], float]:
+    # walks the envelopes of L and -U from start, where F(start) <= 0, to the rightmost root of F
+    # returns the lines of L and -U meeting there and the root
+    lower_idx: int = bisect.bisect_right(lower_breaks, start)
+    upper_idx: int = bisect.bisect_right(upper_breaks, start)
+    while True:
+        lower_next: float = lower_breaks[lower_idx] if lower_idx < len(lower_breaks) else math.inf
+        upper_next: float = upper_breaks[upper_idx] if upper_idx < len(upper_breaks) else math.inf
+        s_right: float = min(lower_next, upper_next)
+        slope: float = lower[lower_idx][0] + upper[upper_idx][0]
+        intercept: float = lower[lower_idx][1] + upper[upper_idx][1]
+        if s_right == math.inf or slope * s_right + intercept > 0:
+            return lower[lower_idx], upper[upper_idx], -intercept / slope
+        if lower_next == s_right:
+            lower_idx += 1
+        if upper_next == s_right:
+            upper_idx += 1
+
+
+def solve_envelope(cons: Constraints) -> Tuple[float, float]:
+    # lower envelope L(s) = max(-a * s + l), upper envelope U(s) = min(-a * s + u) = -max(a * s - u)
+    # F(s) = L(s) - U(s) is convex and F(0) <= 0, so the answer is its rightmost root
+    if isinstance(cons, ConstraintSet):
+        indices: List[int] = list(range(len(cons)))
+        lower, lower_breaks = _max_envelope(list(zip((-cons.slope).tolist(), cons.lower.tolist(), indices)))
+        upper, upper_breaks = _max_envelope(list(zip(cons.slope.tolist(), (-cons.upper).tolist(), indices)))
+    else:
+        lower, lower_breaks = _max_envelope([(-c[0], c[1], idx) for idx, c in enumerate(cons)])
+        upper, upper_breaks = _max_envelope([(c[0], -c[2], idx) for idx, c in enumerate(cons)])
+
+    lower_line, upper_line, s = _rightmost_root(lower, lower_breaks, upper, upper_breaks)
+    return s, cons[upper_line[2]].dx_top_branch(s)
+
+
+solvers: Dict[str, Callable[[Constraints], Tuple[float, float]]] = {
+    'pivot': solve,
+    'envelope': solve_envelope,
+}
+
+
+def same_solution(a: Tuple[float, float], b: Tuple[float, float]) -> bool:
+    return math.isclose(a[0], b[0], rel_tol=1e-9, abs_tol=1e-9) and math.isclose(a[1], b[1], rel_tol=1e-9, abs_tol=1e-9)
+
+
+class SolveStatus(IntEnum):
+    OK = 0
+    NO_CONSTRAINTS = 1
+    INVALID = 2
+    NO_SOLUTIONS = 3
+    INFINITE_SOLUTIONS = 4
+
+
+solve_many_block_elements: int = 1 << 16
+
+
+def _pivot_many(slope: np.ndarray, lower: np.ndarray, upper: np.ndarray, rows: np.ndarray,
+                s: np.ndarray, dx: np.ndarray) -> None:
+    # pivoting as in _solve_columnar, rows leave the working set as soon as they hit an upper branch
+    slope, lower, upper = slope[rows], lower[rows], upper[rows]
+    rows_left: np.ndarray = np.arange(rows.size)
+    constraint_idx: np.ndarray = np.argmax(lower, axis=1)
+    while rows_left.size:
+        row_range: np.ndarray = np.arange(rows_left.size)
+        slope_rows, lower_rows, upper_rows = slope[rows_left], lower[rows_left], upper[rows_left]
+        slope_pivot: np.ndarray = slope_rows[row_range, constraint_idx][:, np.newaxis]
+        lower_pivot: np.ndarray = lower_rows[row_range, constraint_idx][:, np.newaxis]
+        slope_diff: np.ndarray = slope_rows - slope_pivot
+        s_candidates: np.ndarray = np.where(slope_diff < 0, lower_pivot - lower_rows, upper_rows - lower_pivot)
+        s_candidates[slope_diff == 0] = math.inf
+        with np.errstate(divide='ignore'):
+            s_candidates /= np.abs(slope_diff)
+        constraint_idx = np.argmin(s_candidates, axis=1)
+        s_current_max: np.ndarray = s_candidates[row_range, constraint_idx]
+        done: np.ndarray = slope_diff[row_range, constraint_idx] > 0
+        done_rows: np.ndarray = rows[rows_left[done]]
+        s[done_rows] = s_current_max[done]
+        dx[done_rows] = -slope_rows[done, constraint_idx[done]] * s_current_max[done] + \
+            upper_rows[done, constraint_idx[done]]
+        rows_left = rows_left[~done]
+        constraint_idx = constraint_idx[~done]
+
+
+def solve_many(batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # batch has shape (n_instances, n_constraints, 3), returns s, dx and SolveStatus codes per instance
+    # s and dx are nan for instances that are not SolveStatus.OK
+    batch = np.asarray(batch, dtype=np.float64)
+    n_instances: int = batch.shape[0]
+    s: np.ndarray = np.full(n_instances, np.nan)
+    dx: np.ndarray = np.full(n_instances, np.nan)
+    status: np.ndarray = np.full(n_instances, SolveStatus.OK, dtype=np.int8)
+    if batch.shape[1] == 0:
+        status[:] = SolveStatus.NO_CONSTRAINTS
+        return s, dx, status
+
+    slope: np.ndarray = np.ascontiguousarray(batch[:, :, 0])
+    lower: np.ndarray = np.ascontiguousarray(batch[:, :, 1])
+    upper: np.ndarray = np.ascontiguousarray(batch[:, :, 2])
+    # assigned from the last check to the first, so the first failing check of solve_and_test wins
+    status[np.all(slope == slope[:, :1], axis=1)] = SolveStatus.INFINITE_SOLUTIONS
+    status[lower.max(axis=1) > upper.min(axis=1)] = SolveStatus.NO_SOLUTIONS
+    status[np.any(lower > upper, axis=1)] = SolveStatus.INVALID
+
+    # work on blocks of instances small enough to stay in cache
+    ok_rows: np.ndarray = np.flatnonzero(status == SolveStatus.OK)
+    block_size: int = max(1, solve_many_block_elements // batch.shape[1])
+    for block_start in range(0, ok_rows.size, block_size):
+        _pivot_many(slope, lower, upper, ok_rows[block_start:block_start + block_size], s, dx)
+    return s, dx, status
+
+
+class IncrementalSolver:
+    # keeps the optimum of a changing constraint list
+    # the optimum is the largest s where the lower branches stay below the upper branches, solve walks there from
+    # s = 0. Only an add that cuts off the current (s, dx) or the removal of one of the pair of constraints meeting
+    # there can move it, other edits keep the pair.
+    # For re-solving, the slots are split into blocks of about sqrt(n). Each block keeps the envelopes of its lower
+    # and upper branches, rebuilt only after it changed, in O(b log b) for b slots. The optimum is then found by
+    # Newton steps from the right, usually two or three, each evaluating every block in O(log b). Should they not
+    # settle, the breakpoints of all envelopes are bisected at once, finishing on the one line per block and branch
+    # that is left. That makes a re-solve O(sqrt(n) log^2 n), an edit O(log n) and an edit that moves the optimum
+    # O(sqrt(n) log^2 n) at the next query, sublinear however the edits are chosen.
+
+    min_block_size: int = 32
+    newton_steps: int = 8
+
+    def __init__(self, cons: Iterable[Constraint] = ()) -> None:
+        self._slope: np.ndarray = np.empty(16)
+        self._lower: np.ndarray = np.empty(16)
+        self._upper: np.ndarray = np.empty(16)
+        self._alive: np.ndarray = np.zeros(16, dtype=bool)
+        self._used: int = 0
+        self._free: List[int] = []
+        self._slots: Dict[int, int] = {}
+        self._handles: Dict[int, int] = {}
+        self._next_handle: int = 0
+        # heaps of (-lower, handle) and (upper, handle), removed handles are dropped lazily
+        self._lower_heap: List[Tuple[float, int]] = []
+        self._upper_heap: List[Tuple[float, int]] = []
+        self._slopes: Counter = Counter()
+        self._n_invalid: int = 0
+        # per block of slots the envelopes of L and -U as from _max_envelope, at s >= 0, None after a change
+        self._block_size: int = self.min_block_size
+        self._blocks: List[Optional[Tuple[List[Tuple[float, float, int]], List[float], List[Tuple[float, float, int]],
+                                          List[float]]]] = [None]
+        # slots of the constraints whose lower and upper branches meet at the optimum, None when unknown
+        self._pair: Optional[Tuple[int, int]] = None
+        self._s: float = math.nan
+        self._dx: float = math.nan
+        self._interval: Optional[Tuple[float, float]] = None
+        for c in cons:
+            self.add(c)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, constraint: Constraint) -> int:
+        if self._free:
+            slot: int = self._free.pop()
+        else:
+            if self._used == len(self._alive):
+                self._grow()
+            slot = self._used
+            self._used += 1
+        handle: int = self._next_handle
+        self._next_handle += 1
+        self._slots[handle] = slot
+        self._handles[slot] = handle
+
+        a, l, u = constraint.data
+        self._slope[slot], self._lower[slot], self._upper[slot] = a, l, u
+        self._alive[slot] = True
+        self._blocks[slot // self._block_size] = None
+        heapq.heappush(self._lower_heap, (-l, handle))
+        heapq.heappush(self._upper_heap, (u, handle))
+        self._slopes[a] += 1
+        if not constraint.is_valid():
+            self._n_invalid += 1
+
+        self._interval = None
+        if self._pair is not None and not u >= a * self._s + self._dx >= l:
+            # the optimum can only move to smaller s, found again at the next solution()
+            self._pair = None
+        return handle
+
+    def remove(self, handle: int) -> None:
+        slot: int = self._slots.pop(handle)
+        del self._handles[slot]
+        self._alive[slot] = False
+        self._free.append(slot)
+        self._blocks[slot // self._block_size] = None
+        a: float = self._slope[slot]
+        self._slopes[a] -= 1
+        if not self._slopes[a]:
+            del self._slopes[a]
+        if self._lower[slot] > self._upper[slot]:
+            self._n_invalid -= 1
+        if len(self._lower_heap) > 2 * len(self._slots) + 16:
+            self._lower_heap = [item for item in self._lower_heap if item[1] in self._slots]
+            self._upper_heap = [item for item in self._upper_heap if item[1] in self._slots]
+            heapq.heapify(self._lower_heap)
+            heapq.heapify(self._upper_heap)
+
+        self._interval = None
+        if self._pair is not None and slot in self._pair:
+            self._pair = None
+
+    def status(self) -> SolveStatus:
+        if not self._slots:
+            return SolveStatus.NO_CONSTRAINTS
+        if self._n_invalid:
+            return SolveStatus.INVALID
+        while self._lower_heap[0][1] not in self._slots:
+            heapq.heappop(self._lower_heap)
+        while self._upper_heap[0][1] not in self._slots:
+            heapq.heappop(self._upper_heap)
+        if -self._lower_heap[0][0] > self._upper_heap[0][0]:
+            return SolveStatus.NO_SOLUTIONS
+        if len(self._slopes) == 1:
+            return SolveStatus.INFINITE_SOLUTIONS
+        return SolveStatus.OK
+
+    def solution(self) -> Tuple[float, float]:
+        # (nan, nan) unless status() is SolveStatus.OK
+        if self._pair is None:
+            if self.status() != SolveStatus.OK:
+                return math.nan, math.nan
+            self._resolve()
+        return self._s, self._dx
+
+    def dx_interval(self) -> Tuple[float, float]:
+        if self._interval is None:
+            s, _ = self.solution()
+            if math.isnan(s):
+                self._interval = self.constraints().dx_interval(s)
+            else:
+                self._build_blocks()
+                self._interval = self._branches(s)
+        return self._interval
+
+    def optimum_pair(self) -> Optional[Tuple[Tuple[int, Constraint], Tuple[int, Constraint]]]:
+        # (handle, constraint) of the constraint whose lower branch and of the one whose upper branch meet at the
+        # optimum, None unless status() is SolveStatus.OK
+        self.solution()
+        if self._pair is None:
+            return None
+        lower_slot, upper_slot = self._pair
+        return (self._handles[lower_slot], self._constraint(lower_slot)), \
+            (self._handles[upper_slot], self._constraint(upper_slot))
+
+    def constraints(self) -> ConstraintSet:
+        slots: np.ndarray = np.flatnonzero(self._alive[:self._used])
+        return ConstraintSet(self._slope[slots], self._lower[slots], self._upper[slots])
+
+    def _constraint(self, slot: int) -> Constraint:
+        return Constraint((float(self._slope[slot]), float(self._lower[slot]), float(self._upper[slot])))
+
+    def _grow(self) -> None:
+        size: int = 2 * len(self._alive)
+        for name in ('_slope', '_lower', '_upper', '_alive'):
+            old: np.ndarray = getattr(self, name)
+            new: np.ndarray = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        # blocks of about sqrt(n) slots, all rebuilt when their size changes
+        self._block_size = max(self.min_block_size, int(math.sqrt(size)))
+        self._blocks = [None] * -(-size // self._block_size)
+
+    def _build_blocks(self) -> None:
+        for block, envelopes in enumerate(self._blocks):
+            if envelopes is not None:
+                continue
+            start: int = block * self._block_size
+            slots: List[int] = (start + np.flatnonzero(self._alive[start:start + self._block_size])).tolist()
+            # as in solve_envelope, only the parts at s >= 0 are kept
+            lower_k: np.ndarray = -self._slope[slots]
+            lower_b: np.ndarray = self._lower[slots]
+            kept: np.ndarray = _undominated(lower_k, lower_b)
+            lower, lower_breaks = _max_envelope(list(zip(lower_k[kept].tolist(), lower_b[kept].tolist(),
+                                                         np.asarray(slots)[kept].tolist())))
+            upper_k: np.ndarray = self._slope[slots]
+            upper_b: np.ndarray = -self._upper[slots]
+            kept = _undominated(upper_k, upper_b)
+            upper, upper_breaks = _max_envelope(list(zip(upper_k[kept].tolist(), upper_b[kept].tolist(),
+                                                         np.asarray(slots)[kept].tolist())))
+            lower_start: int = bisect.bisect_right(lower_breaks, 0.0)
+            upper_start: int = bisect.bisect_right(upper_breaks, 0.0)
+            self._blocks[block] = (lower[lower_start:], lower_breaks[lower_start:], upper[upper_start:],
+                                   upper_breaks[upper_start:])
+
+    def _branches(self, s: float) -> Tuple[float, float]:
+        # L(s) and U(s) for s >= 0
+        lower: float = -math.inf
+        upper_negated: float = -math.inf
+        bisect_right: Callable = bisect.bisect_right
+        for lower_lines, lower_breaks, upper_lines, upper_breaks in self._blocks:
+            if lower_lines:
+                k, b, _ = lower_lines[bisect_right(lower_breaks, s)]
+                if k * s + b > lower:
+                    lower = k * s + b
+                k, b, _ = upper_lines[bisect_right(upper_breaks, s)]
+                if k * s + b > upper_negated:
+                    upper_negated = k * s + b
+        return lower, -upper_negated
+
+    def _active(self, s: float) -> Tuple[Tuple[float, float, int], Tuple[float, float, int]]:
+        # the lines of L and -U active just left of s > 0
+        lower: float = -math.inf
+        upper_negated: float = -math.inf
+        bisect_left: Callable = bisect.bisect_left
+        for lower_lines, lower_breaks, upper_lines, upper_breaks in self._blocks:
+            if lower_lines:
+                line: Tuple[float, float, int] = lower_lines[bisect_left(lower_breaks, s)]
+                value: float = line[0] * s + line[1]
+                if value > lower or value == lower and line[0] < lower_line[0]:
+                    lower, lower_line = value, line
+                line = upper_lines[bisect_left(upper_breaks, s)]
+                value = line[0] * s + line[1]
+                if value > upper_negated or value == upper_negated and line[0] < upper_line[0]:
+                    upper_negated, upper_line = value, line
+        return lower_line, upper_line
+
+    def _resolve(self) -> None:
+        # status() is OK, so F(0) <= 0 and the optimum is the rightmost root of F as in solve_envelope
+        self._build_blocks()
+        blocks: List[Tuple[List[Tuple[float, float, int]], List[float], List[Tuple[float, float, int]], List[float]]] \
+            = [envelopes for envelopes in self._blocks if envelopes[0]]
+
+        # Newton steps from the right: the lines active left of s give a line below the convex F with the same value
+        # at s, so its root is at most s and at least the optimum; they stop once the lines repeat
+        lower_line: Tuple[float, float, int] = max((envelopes[0][-1] for envelopes in blocks),
+                                                   key=lambda line: line[:2])
+        upper_line: Tuple[float, float, int] = max((envelopes[2][-1] for envelopes in blocks),
+                                                   key=lambda line: line[:2])
+        s: float = -(lower_line[1] + upper_line[1]) / (lower_line[0] + upper_line[0])
+        for _ in range(self.newton_steps):
+            lower_next, upper_next = self._active(s)
+            if lower_next is lower_line and upper_next is upper_line:
+                break
+            slope: float = lower_next[0] + upper_next[0]
+            if slope <= 0:
+                # F has a kink at s and no root right of it
+                break
+            root: float = -(lower_next[1] + upper_next[1]) / slope
+            lower_line, upper_line = lower_next, upper_next
+            if not root < s:
+                s = root
+                break
+            s = root
+        else:
+            self._bisect(blocks, s)
+            return
+        self._pair = lower_line[2], upper_line[2]
+        self._s = s
+        self._dx = -(upper_line[0] * s + upper_line[1])
+
+    def _bisect(self, blocks: List[Tuple[List[Tuple[float, float, int]], List[float], List[Tuple[float, float, int]],
+                                         List[float]]], infeasible: float) -> None:
+        # the root lies between feasible and infeasible, every envelope break in between is a candidate; a weighted
+        # median of the candidates is evaluated to drop at least a quarter of them
+        feasible: float = 0.0
+        ranges: List[Tuple[List[float], int, int]] = [(breaks, 0, len(breaks)) for envelopes in blocks
+                                                      for breaks in envelopes[1::2] if breaks]
+        while ranges:
+            middles: List[Tuple[float, int]] = sorted((breaks[(lo + hi) // 2], hi - lo) for breaks, lo, hi in ranges)
+            half: float = sum(count for _, count in middles) / 2
+            for s, count in middles:
+                half -= count
+                if half <= 0:
+                    break
+            lower, upper = self._branches(s)
+            if lower <= upper:
+                feasible = s
+            else:
+                infeasible = s
+            narrowed: List[Tuple[List[float], int, int]] = []
+            for breaks, lo, hi in ranges:
+                lo = bisect.bisect_right(breaks, feasible, lo, hi)
+                hi = bisect.bisect_left(breaks, infeasible, lo, hi)
+                if lo < hi:
+                    narrowed.append((breaks, lo, hi))
+            ranges = narrowed
+
+        # no envelope has a break between feasible and infeasible, so every block has one line per envelope there,
+        # and one more past infeasible in case rounding put the root on the other side of it
+        lower_lines: List[Tuple[float, float, int]] = []
+        upper_lines: List[Tuple[float, float, int]] = []
+        for lower_block, lower_breaks, upper_block, upper_breaks in blocks:
+            for s in (feasible, infeasible):
+                lower_lines.append(lower_block[bisect.bisect_right(lower_breaks, s)])
+                upper_lines.append(upper_block[bisect.bisect_right(upper_breaks, s)])
+        lower_line, upper_line, s = _rightmost_root(*_max_envelope(lower_lines), *_max_envelope(upper_lines),
+                                                    feasible)
+        self._pair = lower_line[2], upper_line[2]
+        self._s = s
+        self._dx = -(upper_line[0] * s + upper_line[1])
+
+
+class Outcome(Enum):
+    OK = 'ok'
+    NO_CONSTRAINTS = 'no constraints'
+    INVALID = 'has invalid constraints'
+    NO_SOLUTIONS = 'no solutions'
+    INFINITE_SOLUTIONS = 'infinite solutions'
+    CONSTRAINT_VIOLATION = 'ERROR! Constraint violation!'
+    LARGE_INTERVAL = 'ERROR! Large interval'
+    SOLVERS_DISAGREE = 'ERROR! Solvers disagree'
+    INCREMENTAL_DISAGREES = 'ERROR! Incremental solver disagrees'
+
+    def is_error(self) -> bool:
+        return self in (Outcome.CONSTRAINT_VIOLATION, Outcome.LARGE_INTERVAL, Outcome.SOLVERS_DISAGREE,
+                        Outcome.INCREMENTAL_DISAGREES)
+
+
+def check(cons: Constraints, solver: str = 'pivot') -> Outcome:
     if not cons:
-        print('no constraints')
-        return
+        return Outcome.NO_CONSTRAINTS
     if not all_valid_constraints(cons):
-        print('has invalid constraints')
-        return
+        return Outcome.INVALID
     if not has_solutions(cons):
-        print('no solutions')
-        return
+        return Outcome.NO_SOLUTIONS
     if has_infinite_solutions(cons):
-        print('infinite solutions')
-        return
-    s, dx = solve(cons)
+        return Outcome.INFINITE_SOLUTIONS
+    s, dx = solvers[solver](cons)
+    if not verify(cons, s, dx):
+        return Outcome.CONSTRAINT_VIOLATION
     interval = dx_interval(cons, s)
-    if verify(cons, s, dx):
-        if abs(interval[1] - interval[0]) < tolerance:
-            return
-        else:
-            print('ERROR! Large interval')
-    else:
-        print('ERROR! Constraint violation!')
+    if abs(interval[1] - interval[0]) >= tolerance:
+        return Outcome.LARGE_INTERVAL
+    for name, other_solver in solvers.items():
+        if name != solver and not same_solution((s, dx), other_solver(cons)):
+            return Outcome.SOLVERS_DISAGREE
+    return Outcome.OK
+
+
+def check_incremental(cons: Constraints) -> Outcome:
+    # builds cons one constraint at a time, then removes the pair meeting at the optimum and adds it back again,
+    # comparing IncrementalSolver with solve after each of the three steps; cons should check as Outcome.OK
+    solver: IncrementalSolver = IncrementalSolver(cons)
+    if not same_solution(solver.solution(), solve(cons)):
+        return Outcome.INCREMENTAL_DISAGREES
+    # the two constraints of the pair have different slopes, so they are never the same one
+    pair: Tuple[Tuple[int, Constraint], Tuple[int, Constraint]] = solver.optimum_pair()
+    for handle, _ in pair:
+        solver.remove(handle)
+    if solver.status() == SolveStatus.OK and not same_solution(solver.solution(), solve(solver.constraints())):
+        return Outcome.INCREMENTAL_DISAGREES
+    for _, c in pair:
+        solver.add(c)
+    if not same_solution(solver.solution(), solve(solver.constraints())):
+        return Outcome.INCREMENTAL_DISAGREES
+    return Outcome.OK
+
+
+def solve_and_test(cons: Constraints, solver: str = 'pivot') -> None:
+    outcome: Outcome = check(cons, solver)
+    if outcome != Outcome.OK:
+        print(outcome.value)
 
 
 if __name__ == '__main__':
     # solve_and_test(generate_constraints_empty())
     # solve_and_test(generate_constraints_single())
     solve_and_test(generate_constraints_table())
+    solve_and_test(ConstraintSet.make_table())
 
     random.seed(time.time())
     start = time.time()
     for _ in range(10000):
-        solve_and_test(generate_constraints_random(1000))
+        solve_and_test(ConstraintSet.make_random(1000))
     end = time.time()
     print('time elapsed', end - start, 's')
+
+    start = time.time()
+    for _ in range(10):
+        batch = generate_constraints_random_batch(1000, 1000)
+        s_batch, dx_batch, status_batch = solve_many(batch)
+        for idx in np.flatnonzero(status_batch == SolveStatus.OK):
+            if not verify(ConstraintSet.from_array(batch[idx]), s_batch[idx], dx_batch[idx]):
+                print('ERROR! Constraint violation!')
+    end = time.time()
+    print('time elapsed (batched)', end - start, 's')
+
+    start = time.time()
+    incremental_solver = IncrementalSolver(generate_constraints_random(1000))
+    handles = list(range(1000))
+    for _ in range(10000):
+        if random.random() < 0.5:
+            incremental_solver.remove(handles.pop(random.randrange(len(handles))))
+        else:
+            handles.append(incremental_solver.add(Constraint.make_random()))
+        if not same_solution(incremental_solver.solution(), solve(incremental_solver.constraints())):
+            print('ERROR! Incremental solver disagrees')
+    end = time.time()
+    print('time elapsed (incremental)', end - start, 's')
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass, asdict
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from optimization import Constraint, ConstraintSet, Constraints, IncrementalSolver, all_valid_constraints, \
+    dx_interval, generate_constraints_random_batch, has_infinite_solutions, has_solutions, same_solution, solve, \
+    solvers, verify
+
+
+default_sizes: List[int] = [10, 100, 1000, 10000, 100000]
+# number of constraints timed per size and case, split into max(1, budget // n) instances
+default_budget: int = 100000
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    representation: str
+    n_constraints: int
+    n_instances: int
+    seconds_per_call: float
+    calls_per_second: float
+    seconds_per_constraint: float
+    peak_bytes: int
+    # solve cases only: instances whose result differs from the optimum found by solve
+    disagreements: int = 0
+
+
+def make_instances(n_constraints: int, n_instances: int, seed: int, representation: str) -> List[Constraints]:
+    # the same seed gives the same instances for both representations
+    batch: np.ndarray = generate_constraints_random_batch(n_instances, n_constraints, np.random.default_rng(seed))
+    if representation == 'set':
+        return [ConstraintSet.from_array(instance) for instance in batch]
+    return [[Constraint((a, l, u)) for a, l, u in instance.tolist()] for instance in batch]
+
+
+# every case gets an instance together with its optimum (s, dx)
+Case = Callable[[Constraints, float, float], Any]
+Instance = Tuple[Constraints, float, float]
+
+
+def make_cases() -> Dict[str, Case]:
+    cases: Dict[str, Case] = {}
+    for solver_name, solver in solvers.items():
+        cases['solve[' + solver_name + ']'] = lambda cons, s, dx, solver=solver: solver(cons)
+    # builds the solver one constraint at a time
+    cases['solve[incremental]'] = lambda cons, s, dx: IncrementalSolver(cons).solution()
+    cases['all_valid_constraints'] = lambda cons, s, dx: all_valid_constraints(cons)
+    cases['has_solutions'] = lambda cons, s, dx: has_solutions(cons)
+    cases['has_infinite_solutions'] = lambda cons, s, dx: has_infinite_solutions(cons)
+    cases['dx_interval'] = lambda cons, s, dx: dx_interval(cons, s)
+    cases['verify'] = verify
+    return cases
+
+
+def _time_case(case: Case, instances: Sequence[Instance], repeats: int) -> float:
+    best: float = float('inf')
+    for _ in range(repeats):
+        start: float = time.perf_counter()
+        for cons, s, dx in instances:
+            case(cons, s, dx)
+        best = min(best, time.perf_counter() - start)
+    return best / len(instances)
+
+
+def _disagreements(case: Case, instances: Sequence[Instance]) -> int:
+    return sum(not same_solution(case(cons, s, dx), (s, dx)) for cons, s, dx in instances)
+
+
+def _peak_memory(case: Case, instance: Instance) -> int:
+    tracemalloc.start()
+    try:
+        case(*instance)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes: Sequence[int] = default_sizes, seed: int = 0, budget: int = default_budget, repeats: int = 3,
+        representations: Sequence[str] = ('list', 'set'), case_names: Optional[Sequence[str]] = None) \
+        -> List[BenchmarkResult]:
+    cases: Dict[str, Case] = make_cases()
+    results: List[BenchmarkResult] = []
+    for n_constraints in sizes:
+        n_instances: int = max(1, budget // n_constraints)
+        for representation in representations:
+            instances: List[Instance] = [(cons,) + solve(cons) for cons in
+                                         make_instances(n_constraints, n_instances, seed + n_constraints,
+                                                        representation)]
+            for name, case in cases.items():
+                if case_names is not None and name not in case_names:
+                    continue
+                seconds_per_call: float = _time_case(case, instances, repeats)
+                results.append(BenchmarkResult(name, representation, n_constraints, n_instances, seconds_per_call,
+                                               1.0 / seconds_per_call, seconds_per_call / n_constraints,
+                                               _peak_memory(case, instances[0]),
+                                               _disagreements(case, instances) if name.startswith('solve[') else 0))
+    return results
+
+
+def _key(result: Dict[str, Any]) -> str:
+    return '{}/{}/{}'.format(result['name'], result['representation'], result['n_constraints'])
+
+
+def save(results: Sequence[BenchmarkResult], path: str, seed: int) -> None:
+    document: Dict[str, Any] = {
+        'seed': seed,
+        'python': sys.version,
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': [asdict(result) for result in results],
+    }
+    with open(path, 'w') as file:
+        json.dump(document, file, indent=2)
+
+
+def find_regressions(results: Sequence[BenchmarkResult], baseline_path: str, threshold: float) -> List[str]:
+    with open(baseline_path) as file:
+        baseline: Dict[str, Dict[str, Any]] = {_key(result): result for result in json.load(file)['results']}
+    regressions: List[str] = []
+    for result in results:
+        reference: Optional[Dict[str, Any]] = baseline.get(_key(asdict(result)))
+        if reference is None:
+            continue
+        ratio: float = result.seconds_per_call / reference['seconds_per_call']
+        if ratio > 1.0 + threshold:
+            regressions.append('{}: {:.3g}x slower than baseline'.format(_key(asdict(result)), ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the optimization module')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budget', type=int, default=default_budget)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--representations', nargs='+', default=['list', 'set'])
+    parser.add_argument('--cases', nargs='+', default=None)
+    parser.add_argument('--output', default='optimization_benchmark.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    benchmark_results: List[BenchmarkResult] = run(args.sizes, args.seed, args.budget, args.repeats,
+                                                   args.representations, args.cases)
+    for benchmark_result in benchmark_results:
+        print('{:28} {:5} n={:<7} {:12.3e} s/call {:12.3e} s/constraint {:10d} B peak'.format(
+            benchmark_result.name, benchmark_result.representation, benchmark_result.n_constraints,
+            benchmark_result.seconds_per_call, benchmark_result.seconds_per_constraint, benchmark_result.peak_bytes))
+    save(benchmark_results, args.output, args.seed)
+
+    disagreeing: List[BenchmarkResult] = [result for result in benchmark_results if result.disagreements]
+    for benchmark_result in disagreeing:
+        print('DISAGREES', '{}/{}/{}: {} of {} instances'.format(
+            benchmark_result.name, benchmark_result.representation, benchmark_result.n_constraints,
+            benchmark_result.disagreements, benchmark_result.n_instances))
+
+    if args.baseline is not None:
+        found_regressions: List[str] = find_regressions(benchmark_results, args.baseline, args.threshold)
+        for regression in found_regressions:
+            print('REGRESSION', regression)
+        if found_regressions:
+            sys.exit(1)
+    if disagreeing:
+        sys.exit(1)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import Counter
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+import argparse
+import os
+import time
+
+import numpy as np
+
+from optimization import ConstraintSet, Outcome, check, check_incremental, generate_constraints_random_batch
+
+
+@dataclass
+class SoakReport:
+    counts: Dict[Outcome, int] = field(default_factory=dict)
+    failing_seeds: List[int] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def n_instances(self) -> int:
+        return sum(self.counts.values())
+
+    def n_errors(self) -> int:
+        return sum(count for outcome, count in self.counts.items() if outcome.is_error())
+
+
+def instance_seed(seed: int, idx: int) -> int:
+    # every instance has its own seed, so results do not depend on the number of workers or the chunk size
+    return int(np.random.SeedSequence([seed, idx]).generate_state(1, dtype=np.uint64)[0])
+
+
+def generate_instance(seed: int, n_constraints: int) -> np.ndarray:
+    return generate_constraints_random_batch(1, n_constraints, np.random.default_rng(seed))[0]
+
+
+def check_instance(cons: ConstraintSet, solver: str, incremental: bool) -> Outcome:
+    # instances the solver gets right are also built and repaired by IncrementalSolver
+    outcome: Outcome = check(cons, solver)
+    if incremental and outcome == Outcome.OK:
+        outcome = check_incremental(cons)
+    return outcome
+
+
+def _check_chunk(job: Tuple[int, int, int, int, str, bool]) -> Tuple[Counter, List[int]]:
+    seed, start, count, n_constraints, solver, incremental = job
+    counts: Counter = Counter()
+    failing_seeds: List[int] = []
+    for idx in range(start, start + count):
+        current_seed: int = instance_seed(seed, idx)
+        outcome: Outcome = check_instance(ConstraintSet.from_array(generate_instance(current_seed, n_constraints)),
+                                          solver, incremental)
+        counts[outcome] += 1
+        if outcome.is_error():
+            failing_seeds.append(current_seed)
+    return counts, failing_seeds
+
+
+def _jobs(seed: int, n_instances: int, n_constraints: int, solver: str, chunk_size: int, incremental: bool) \
+        -> Iterator[Tuple[int, int, int, int, str, bool]]:
+    for start in range(0, n_instances, chunk_size):
+        yield seed, start, min(chunk_size, n_instances - start), n_constraints, solver, incremental
+
+
+def soak(n_instances: int, n_constraints: int, seed: int = 0, workers: Optional[int] = None,
+         chunk_size: int = 100, solver: str = 'pivot', incremental: bool = True) -> SoakReport:
+    # only (seed, range) jobs are sent to the workers, the instances are generated there as arrays
+    report: SoakReport = SoakReport()
+    counts: Counter = Counter()
+    start_time: float = time.time()
+    jobs: Iterator[Tuple[int, int, int, int, str, bool]] = _jobs(seed, n_instances, n_constraints, solver, chunk_size,
+                                                                 incremental)
+    if workers == 1:
+        results: Iterator[Tuple[Counter, List[int]]] = map(_check_chunk, jobs)
+        for chunk_counts, chunk_failing_seeds in results:
+            counts.update(chunk_counts)
+            report.failing_seeds.extend(chunk_failing_seeds)
+    else:
+        with Pool(workers) as pool:
+            for chunk_counts, chunk_failing_seeds in pool.imap_unordered(_check_chunk, jobs):
+                counts.update(chunk_counts)
+                report.failing_seeds.extend(chunk_failing_seeds)
+    report.counts = dict(counts)
+    report.failing_seeds.sort()
+    report.elapsed = time.time() - start_time
+    return report
+
+
+def recheck(seed: int, n_constraints: int, solver: str = 'pivot', incremental: bool = True) -> Outcome:
+    return check_instance(ConstraintSet.from_array(generate_instance(seed, n_constraints)), solver, incremental)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='randomized soak test of optimization.solve')
+    parser.add_argument('--instances', type=int, default=10000)
+    parser.add_argument('--constraints', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--solver', default='pivot')
+    parser.add_argument('--no-incremental', dest='incremental', action='store_false',
+                        help='skip comparing IncrementalSolver with solve')
+    args = parser.parse_args()
+
+    soak_report: SoakReport = soak(args.instances, args.constraints, args.seed, args.workers, args.chunk_size,
+                                   args.solver, args.incremental)
+    for soak_outcome, soak_count in sorted(soak_report.counts.items(), key=lambda oc: oc[0].name):
+        print(soak_outcome.value, soak_count)
+    for failing_seed in soak_report.failing_seeds:
+        print('failing seed', failing_seed)
+    print('time elapsed', soak_report.elapsed, 's')
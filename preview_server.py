@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import argparse
+import asyncio
+import base64
+import io
+import logging
+import socket
+
+from circuit_scheme import RenderQuality, full_quality, quality_levels
+from AnimateScheme import FrameSequence
+
+
+# Local preview of the scheme animation: the frames are rendered in order, looping, while anybody watches, and every
+# frame is sent to every viewer as soon as it is encoded, either as MJPEG (multipart/x-mixed-replace, shown by a
+# plain <img>) or as server-sent events carrying base64 PNGs.
+# One broadcast renders and encodes each frame once for all viewers, in an executor so the event loop keeps serving.
+# It only keeps the latest frame: a viewer that is still sending an older one skips to the latest when done, so slow
+# viewers drop frames instead of holding up rendering or the other viewers.
+
+mjpeg_boundary: str = 'frame'
+jpeg_quality: int = 85
+formats: Tuple[str, ...] = ('jpeg', 'png')
+# socket and transport buffers of a stream, kept small so that drain waits for the viewer and a lagging viewer skips
+# frames instead of queueing them
+stream_send_buffer: int = 64 * 1024
+# encoded frames kept for later loops of the animation, the oldest are dropped beyond this many bytes
+encoded_cache_bytes: int = 64 * 1024 * 1024
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+index_page: str = '''<!doctype html>
+<title>scheme preview</title>
+<body style="margin:0;background:#808080">
+<img src="/stream.mjpeg" style="max-width:100%;max-height:100vh">
+'''
+
+sse_page: str = '''<!doctype html>
+<title>scheme preview</title>
+<body style="margin:0;background:#808080">
+<img id="frame" style="max-width:100%;max-height:100vh">
+<script>
+new EventSource('/events').addEventListener('frame', event => {
+    document.getElementById('frame').src = 'data:image/png;base64,' + event.data;
+});
+</script>
+'''
+
+
+def encode_frame(sequence: FrameSequence, idx: int, image_formats: Tuple[str, ...]) -> Dict[str, bytes]:
+    frame = sequence[idx]
+    encoded: Dict[str, bytes] = {}
+    for image_format in image_formats:
+        buffer: io.BytesIO = io.BytesIO()
+        if image_format == 'jpeg':
+            frame.convert('RGB').save(buffer, format='JPEG', quality=jpeg_quality)
+        else:
+            frame.save(buffer, format='PNG', compress_level=1)
+        encoded[image_format] = buffer.getvalue()
+    return encoded
+
+
+@dataclass(eq=False)
+class FrameBroadcast:
+    sequence: FrameSequence
+    # seconds between frames at most, the frame duration of the animation
+    interval: float = 0.02
+    executor: ThreadPoolExecutor = field(default_factory=lambda: ThreadPoolExecutor(1))
+    # number of the latest frame, counting from 1 over all loops, and its encodings
+    seq: int = 0
+    frames: Dict[str, bytes] = field(default_factory=dict)
+    # encoded frames of the looping animation are kept up to encoded_cache_bytes, later loops send them again
+    encoded: OrderedDict = field(default_factory=OrderedDict, repr=False)
+    encoded_bytes: int = 0
+    # viewers per format
+    viewers: Dict[str, int] = field(default_factory=lambda: {image_format: 0 for image_format in formats})
+    rendered: int = 0
+    sent: int = 0
+    dropped: int = 0
+    failed: int = 0
+    changed: asyncio.Condition = field(default_factory=asyncio.Condition, repr=False)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def subscribe(self, image_format: str) -> None:
+        self.viewers[image_format] += 1
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self, image_format: str) -> None:
+        self.viewers[image_format] -= 1
+
+    async def _run(self) -> None:
+        # renders while anybody watches
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        idx: int = 0
+        try:
+            while any(self.viewers.values()):
+                start: float = loop.time()
+                wanted: List[str] = [f for f, n in self.viewers.items() if n]
+                try:
+                    frames: Dict[str, bytes] = await self._encoded(loop, idx, wanted)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # a frame that fails is skipped, viewers keep the previous one and get the next
+                    logger.exception('encoding frame %d failed', idx)
+                    self.failed += 1
+                else:
+                    async with self.changed:
+                        self.seq += 1
+                        self.frames = frames
+                        self.changed.notify_all()
+                idx = (idx + 1) % len(self.sequence)
+                await asyncio.sleep(max(0.0, self.interval - (loop.time() - start)))
+        finally:
+            self.task = None
+
+    async def _encoded(self, loop: asyncio.AbstractEventLoop, idx: int, wanted: List[str]) -> Dict[str, bytes]:
+        missing: Tuple[str, ...] = tuple(f for f in wanted if (idx, f) not in self.encoded)
+        if missing:
+            for image_format, data in (await loop.run_in_executor(
+                    self.executor, encode_frame, self.sequence, idx, missing)).items():
+                self.encoded[idx, image_format] = data
+                self.encoded_bytes += len(data)
+            self.rendered += 1
+        frames: Dict[str, bytes] = {}
+        for image_format in wanted:
+            self.encoded.move_to_end((idx, image_format))
+            frames[image_format] = self.encoded[idx, image_format]
+        while self.encoded_bytes > encoded_cache_bytes and len(self.encoded) > len(wanted):
+            self.encoded_bytes -= len(self.encoded.popitem(last=False)[1])
+        return frames
+
+    async def next_frame(self, after: int, image_format: str) -> Tuple[int, bytes]:
+        # the latest frame newer than after, intermediate ones are skipped
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.seq > after and image_format in self.frames)
+            return self.seq, self.frames[image_format]
+
+
+async def _stream(broadcast: FrameBroadcast, writer: asyncio.StreamWriter, image_format: str) -> None:
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, stream_send_buffer)
+    writer.transport.set_write_buffer_limits(high=stream_send_buffer)
+    broadcast.subscribe(image_format)
+    try:
+        seq: int = 0
+        while True:
+            previous: int = seq
+            seq, data = await broadcast.next_frame(seq, image_format)
+            if previous:
+                broadcast.dropped += seq - previous - 1
+            if image_format == 'jpeg':
+                writer.write('--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n'.format(
+                    mjpeg_boundary, len(data)).encode() + data + b'\r\n')
+            else:
+                writer.write('id: {}\nevent: frame\ndata: '.format(seq).encode() + base64.b64encode(data) + b'\n\n')
+            await writer.drain()
+            broadcast.sent += 1
+    except ConnectionError:
+        pass
+    finally:
+        broadcast.unsubscribe(image_format)
+
+
+def _response(status: str, content_type: str, body: bytes = b'', streaming: bool = False) -> bytes:
+    headers: List[str] = ['HTTP/1.1 ' + status, 'Content-Type: ' + content_type, 'Cache-Control: no-cache',
+                          'Connection: close']
+    if not streaming:
+        headers.append('Content-Length: {}'.format(len(body)))
+    return ('\r\n'.join(headers) + '\r\n\r\n').encode() + body
+
+
+async def handle(broadcast: FrameBroadcast, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request: bytes = await reader.readuntil(b'\r\n\r\n')
+        method, path = (request.split(b'\r\n', 1)[0].decode('latin-1').split(' ') + ['', ''])[:2]
+        path = path.split('?', 1)[0]
+        if method != 'GET':
+            writer.write(_response('405 Method Not Allowed', 'text/plain', b'only GET\n'))
+        elif path == '/':
+            writer.write(_response('200 OK', 'text/html', index_page.encode()))
+        elif path == '/sse':
+            writer.write(_response('200 OK', 'text/html', sse_page.encode()))
+        elif path == '/stream.mjpeg':
+            writer.write(_response('200 OK', 'multipart/x-mixed-replace; boundary=' + mjpeg_boundary, streaming=True))
+            await _stream(broadcast, writer, 'jpeg')
+        elif path == '/events':
+            writer.write(_response('200 OK', 'text/event-stream', streaming=True))
+            await _stream(broadcast, writer, 'png')
+        else:
+            writer.write(_response('404 Not Found', 'text/plain', b'not found\n'))
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8000, quality: RenderQuality = full_quality,
+                interval: float = 0.02) -> None:
+    with FrameSequence(quality=quality) as sequence:
+        broadcast: FrameBroadcast = FrameBroadcast(sequence, interval)
+        server: asyncio.Server = await asyncio.start_server(
+            lambda reader, writer: handle(broadcast, reader, writer), host, port)
+        print('serving the scheme animation on http://{}:{}/ (server-sent PNGs on /sse)'.format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            broadcast.executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local preview server streaming the scheme animation')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--quality', choices=sorted(quality_levels), default='draft')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds per frame at most')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, quality_levels[args.quality], args.interval))
+    except KeyboardInterrupt:
+        pass
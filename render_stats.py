@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+import argparse
+import cProfile
+import json
+import os
+import time
+
+
+# Opt-in instrumentation of drawing and encoding. While disabled, stats is None and instrumented code only pays for
+# that check. Keys are tuples starting with the category:
+#     ('geometry', class name)          coordinates of the elements of a class transformed to pixels
+#     ('raster', class name)            ImageDraw calls of the elements or compiled primitives of a class
+#     ('static', stage)                 static layer of an animation stage
+#     ('frame', stage, step)            a whole animation frame, including the above
+#     ('encode', phase)                 animation writers: 'diff', 'prepare', 'write' and 'full_frame'
+#     ('save_png', phase)               Circuit.save_png: 'render' and 'encode'
+# items counts what was timed, elements for geometry and raster, frames and images otherwise.
+
+Key = Tuple[Hashable, ...]
+
+
+@dataclass
+class Timer:
+    calls: int = 0
+    items: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class RenderStats:
+    timers: Dict[Key, Timer] = field(default_factory=dict)
+    # (key, start, duration, process id) of every timed span when tracing, start relative to trace_origin
+    events: Optional[List[Tuple[Key, float, float, int]]] = None
+    trace_origin: float = field(default_factory=time.perf_counter)
+
+    def add(self, key: Key, seconds: float, items: int = 1, start: Optional[float] = None) -> None:
+        timer: Optional[Timer] = self.timers.get(key)
+        if timer is None:
+            timer = self.timers[key] = Timer()
+        timer.calls += 1
+        timer.items += items
+        timer.seconds += seconds
+        if self.events is not None and start is not None:
+            self.events.append((key, start - self.trace_origin, seconds, os.getpid()))
+
+    def take(self) -> RenderStats:
+        # moves the collected numbers out, e.g. to send them from a worker process to the parent
+        taken: RenderStats = RenderStats(self.timers, self.events, self.trace_origin)
+        self.timers = {}
+        self.events = None if self.events is None else []
+        return taken
+
+    def merge(self, other: RenderStats) -> None:
+        for key, timer in other.timers.items():
+            own: Optional[Timer] = self.timers.get(key)
+            if own is None:
+                own = self.timers[key] = Timer()
+            own.calls += timer.calls
+            own.items += timer.items
+            own.seconds += timer.seconds
+        if self.events is not None and other.events is not None:
+            # worker clocks are the same monotonic clock, only the origins differ
+            shift: float = other.trace_origin - self.trace_origin
+            self.events += [(key, start + shift, seconds, pid) for key, start, seconds, pid in other.events]
+
+    def totals(self, depth: int = 1) -> Dict[Key, Timer]:
+        # timers summed over keys sharing their first depth parts
+        totals: Dict[Key, Timer] = {}
+        for key, timer in self.timers.items():
+            total: Timer = totals.setdefault(key[:depth], Timer())
+            total.calls += timer.calls
+            total.items += timer.items
+            total.seconds += timer.seconds
+        return totals
+
+    def table(self, depth: int = 2) -> str:
+        rows: List[str] = ['{:40} {:>8} {:>9} {:>10}'.format('key', 'calls', 'items', 'seconds')]
+        for key, timer in sorted(self.totals(depth).items(), key=lambda item: -item[1].seconds):
+            rows.append('{:40} {:8d} {:9d} {:10.4f}'.format('/'.join(str(part) for part in key), timer.calls,
+                                                             timer.items, timer.seconds))
+        return '\n'.join(rows)
+
+    def save_trace(self, path: str) -> None:
+        # Chrome trace event format, opens in chrome://tracing or Perfetto
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': [
+                {'name': '/'.join(str(part) for part in key), 'cat': str(key[0]), 'ph': 'X', 'ts': start * 1e6,
+                 'dur': seconds * 1e6, 'pid': pid, 'tid': pid} for key, start, seconds, pid in self.events or []]},
+                file)
+
+
+stats: Optional[RenderStats] = None
+
+
+class _Span:
+    __slots__ = ('collector', 'key', 'items', 'start')
+
+    def __init__(self, collector: RenderStats, key: Key, items: int) -> None:
+        self.collector: RenderStats = collector
+        self.key: Key = key
+        self.items: int = items
+
+    def __enter__(self) -> _Span:
+        self.start: float = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.collector.add(self.key, time.perf_counter() - self.start, self.items, self.start)
+
+
+_disabled = nullcontext()
+
+
+def timed(*key: Hashable, items: int = 1):
+    # for spans of at least a whole frame or element class, per element code should check stats itself
+    return _disabled if stats is None else _Span(stats, key, items)
+
+
+def enable(trace: bool = False) -> RenderStats:
+    global stats
+    stats = RenderStats(events=[] if trace else None)
+    return stats
+
+
+def disable() -> Optional[RenderStats]:
+    global stats
+    collected: Optional[RenderStats] = stats
+    stats = None
+    return collected
+
+
+@contextmanager
+def collect(trace_path: Optional[str] = None, profile_path: Optional[str] = None) -> Iterator[RenderStats]:
+    # stats of the block, optionally written as a trace and a cProfile dump (pstats / snakeviz) as well
+    collected: RenderStats = enable(trace_path is not None)
+    profile: Optional[cProfile.Profile] = None if profile_path is None else cProfile.Profile()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield collected
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path)
+        disable()
+        if trace_path is not None:
+            collected.save_trace(trace_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='instrumented run of the scheme animation demo')
+    parser.add_argument('--format', default='GIF')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--trace', default=None, help='Chrome trace event JSON output')
+    parser.add_argument('--profile', default=None, help='cProfile output')
+    args = parser.parse_args()
+
+    # the modules drawing frames see the imported module, not this script
+    import render_stats
+    from AnimateScheme import demo
+
+    with render_stats.collect(args.trace, args.profile) as demo_stats:
+        demo(args.format)
+    print(demo_stats.table(args.depth))
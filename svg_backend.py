@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Callable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from contextlib import contextmanager
+from xml.sax.saxutils import quoteattr
+
+
+Color = Union[Tuple[int, int, int], str]
+Coords = Sequence[Union[float, Tuple[float, float]]]
+
+
+# SvgDraw stands in for ImageDraw.ImageDraw wherever schemes are drawn: it takes the same line, rectangle and ellipse
+# calls in the same pixel coordinates and records them as SVG elements, so a browser scales the result instead of
+# rasterizing it at full size. Pillow treats coordinates as pixel centres with inclusive boxes and draws rectangle
+# and ellipse outlines inwards, the elements are placed to match.
+#
+# Repeated symbols can be defined once and placed with use; colors given as 'currentColor' in a definition take the
+# color of each placement.
+
+def svg_color(color: Optional[Color]) -> str:
+    if color is None:
+        return 'none'
+    if isinstance(color, str):
+        return color
+    return '#{:02x}{:02x}{:02x}'.format(*color[:3])
+
+
+def _points(xy: Coords) -> List[Tuple[float, float]]:
+    # Pillow accepts [(x, y), ...] as well as [x, y, ...]
+    if xy and not isinstance(xy[0], (tuple, list)):
+        return list(zip(xy[0::2], xy[1::2]))
+    return [tuple(p) for p in xy]
+
+
+def _number(value: float) -> str:
+    return '{:.6g}'.format(value)
+
+
+class SvgDraw:
+    def __init__(self, size: Tuple[int, int], background: Optional[Color] = (255, 255, 255)) -> None:
+        self.size: Tuple[int, int] = size
+        self.background: Optional[Color] = background
+        self.defs: List[str] = []
+        self.defined: Set[str] = set()
+        self.elements: List[str] = []
+
+    def line(self, xy: Coords, fill: Optional[Color] = None, width: int = 0, joint: Optional[str] = None) -> None:
+        points: List[Tuple[float, float]] = _points(xy)
+        self.elements.append('<polyline points="{}" fill="none" stroke={} stroke-width="{}"{}/>'.format(
+            ' '.join(_number(x + 0.5) + ',' + _number(y + 0.5) for x, y in points), quoteattr(svg_color(fill)),
+            _number(max(width, 1)), ' stroke-linejoin="round"' if joint == 'curve' else ''))
+
+    def rectangle(self, xy: Coords, fill: Optional[Color] = None, outline: Optional[Color] = None,
+                  width: int = 1) -> None:
+        (x0, y0), (x1, y1) = _points(xy)
+        inset: float = width / 2 if outline is not None else 0.0
+        self.elements.append('<rect x="{}" y="{}" width="{}" height="{}" fill={}{}/>'.format(
+            _number(x0 + inset), _number(y0 + inset), _number(max(x1 - x0 + 1 - 2 * inset, 0)),
+            _number(max(y1 - y0 + 1 - 2 * inset, 0)), quoteattr(svg_color(fill)), self._stroke(outline, width)))
+
+    def ellipse(self, xy: Coords, fill: Optional[Color] = None, outline: Optional[Color] = None,
+                width: int = 1) -> None:
+        (x0, y0), (x1, y1) = _points(xy)
+        inset: float = width / 2 if outline is not None else 0.0
+        self.elements.append('<ellipse cx="{}" cy="{}" rx="{}" ry="{}" fill={}{}/>'.format(
+            _number((x0 + x1 + 1) / 2), _number((y0 + y1 + 1) / 2), _number(max((x1 - x0 + 1) / 2 - inset, 0)),
+            _number(max((y1 - y0 + 1) / 2 - inset, 0)), quoteattr(svg_color(fill)), self._stroke(outline, width)))
+
+    @staticmethod
+    def _stroke(outline: Optional[Color], width: int) -> str:
+        if outline is None:
+            return ''
+        return ' stroke={} stroke-width="{}"'.format(quoteattr(svg_color(outline)), _number(width))
+
+    def define(self, name: str, draw_fn: Callable[[SvgDraw], None]) -> None:
+        # draw_fn draws the symbol around the origin of its own coordinates, once per name
+        if name in self.defined:
+            return
+        symbol: SvgDraw = SvgDraw(self.size, None)
+        draw_fn(symbol)
+        self.defs.append('<g id={}>{}</g>'.format(quoteattr(name), ''.join(symbol.elements)))
+        self.defined.add(name)
+
+    def use(self, name: str, x: float, y: float, angle: float = 0.0, color: Optional[Color] = None) -> None:
+        # angle in degrees, clockwise on the image as y points down
+        transform: str = 'translate({},{})'.format(_number(x), _number(y))
+        if angle:
+            transform += ' rotate({})'.format(_number(angle))
+        self.elements.append('<use href="#{0}" xlink:href="#{0}" transform="{1}"{2}/>'.format(
+            name, transform, '' if color is None else ' color=' + quoteattr(svg_color(color))))
+
+    @contextmanager
+    def group(self, *children: str, hidden: bool = False) -> Iterator[SvgDraw]:
+        # children go first, e.g. animation elements of the group
+        self.elements.append(('<g visibility="hidden">' if hidden else '<g>') + ''.join(children))
+        try:
+            yield self
+        finally:
+            self.elements.append('</g>')
+
+    def tostring(self) -> str:
+        width, height = self.size
+        parts: List[str] = [
+            '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            'width="{0}" height="{1}" viewBox="0 0 {0} {1}">'.format(width, height)]
+        if self.background is not None:
+            parts.append('<rect width="100%" height="100%" fill={}/>'.format(quoteattr(svg_color(self.background))))
+        if self.defs:
+            parts.append('<defs>' + ''.join(self.defs) + '</defs>')
+        parts += self.elements
+        parts.append('</svg>')
+        return '\n'.join(parts) + '\n'
+
+    def save(self, pf: Union[BinaryIO, str]) -> None:
+        data: bytes = self.tostring().encode()
+        if isinstance(pf, str):
+            with open(pf, 'wb') as file:
+                file.write(data)
+        else:
+            pf.write(data)
+
+
+def frame_visibility(first: int, last: int, n_frames: int, frame_seconds: float, loop: Optional[int] = None) -> str:
+    # shows a hidden group from frame first to frame last inclusive, loop as in animation_writer: None plays once,
+    # 0 repeats forever, k repeats k more times, the last frame stays when playing ends
+    states: List[Tuple[str, float]] = []
+    if first > 0:
+        states.append(('hidden', 0.0))
+    states.append(('visible', first / n_frames))
+    if last + 1 < n_frames:
+        states.append(('hidden', (last + 1) / n_frames))
+    repeat: str = '' if loop is None else ' repeatCount="{}"'.format('indefinite' if loop == 0 else loop + 1)
+    return '<animate attributeName="visibility" calcMode="discrete" values="{}" keyTimes="{}" dur="{}s" ' \
+           'fill="freeze"{}/>'.format(';'.join(state for state, _ in states), ';'.join(_number(t) for _, t in states),
+                                      _number(n_frames * frame_seconds), repeat)
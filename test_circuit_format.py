@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from circuit_scheme import Circuit, Contact, Grounding
+import circuit_format
+from circuit_format import CircuitFormatError, load, same_circuit, save
+
+
+def make_circuit(n: int = 1000) -> Circuit:
+    rng = np.random.default_rng(0)
+    circuit = Circuit([Contact(0, 1000), Grounding(1000, 0)])
+    circuit.add_many(Contact, rng.uniform(-1e4, 1e4, (n, 2)))
+    circuit.add_many(Grounding, rng.uniform(-1e4, 1e4, (n, 2)))
+    circuit.add(Contact(-5.5, 7.25))
+    return circuit
+
+
+def render(circuit: Circuit) -> bytes:
+    return circuit.render_region(((-3000, -3000), (3000, 3000)), (200, 200)).tobytes()
+
+
+@pytest.mark.parametrize('binary, mmap', [(False, False), (True, False), (True, True)])
+def test_round_trip(tmp_path, binary, mmap):
+    circuit = make_circuit()
+    path = str(tmp_path / 'circuit')
+    save(circuit, path, binary)
+    loaded = load(path, mmap)
+    assert same_circuit(circuit, loaded)
+    assert loaded.bbox == circuit.bbox
+    assert loaded.elements == circuit.elements
+    assert loaded.elements[0] == Contact(0, 1000) and loaded.elements[1] == Grounding(1000, 0)
+    assert render(loaded) == render(circuit)
+
+
+@pytest.mark.parametrize('binary, mmap', [(False, False), (True, False), (True, True)])
+def test_empty_circuit(tmp_path, binary, mmap):
+    path = str(tmp_path / 'circuit')
+    save(Circuit(), path, binary)
+    loaded = load(path, mmap)
+    assert len(loaded.elements) == 0
+    assert loaded.bbox is None
+    assert same_circuit(Circuit(), loaded)
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_loaded_circuit_can_grow(tmp_path, mmap):
+    path = str(tmp_path / 'circuit.bin')
+    save(make_circuit(10), path)
+    loaded = load(path, mmap)
+    loaded.add(Grounding(1e5, 1e5))
+    loaded.elements[0].x = -1e5
+    assert loaded.elements[-1] == Grounding(1e5, 1e5)
+    assert loaded.bbox[0][0] < -1e5 and loaded.bbox[1][0] > 1e5
+    assert load(path, mmap).elements[0] == Contact(0, 1000)
+
+
+def test_text_comments_and_errors(tmp_path):
+    path = str(tmp_path / 'circuit.txt')
+    with open(path, 'w') as file:
+        file.write('circuit 1\n# a comment\n\nContact 0.0 1000.0\nGrounding 1000 0\n')
+    assert load(path).elements == [Contact(0, 1000), Grounding(1000, 0)]
+
+    for text in ('circuit 2\n', 'circuit 1\nResistor 0 0\n', 'circuit 1\nContact 0\n'):
+        with open(path, 'w') as file:
+            file.write(text)
+        with pytest.raises(CircuitFormatError):
+            load(path)
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_truncated_binary(tmp_path, mmap):
+    path = str(tmp_path / 'circuit.bin')
+    save(make_circuit(10), path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    truncated = str(tmp_path / 'truncated.bin')
+    for size in (len(circuit_format.binary_magic), 80, 120, 232, len(data) - 8, len(data) - 1):
+        with open(truncated, 'wb') as file:
+            file.write(data[:size])
+        with pytest.raises(CircuitFormatError):
+            load(truncated, mmap)
+
+
+def test_binary_bad_header(tmp_path):
+    path = str(tmp_path / 'circuit.bin')
+    save(make_circuit(10), path)
+    header = np.fromfile(path, dtype=circuit_format.binary_header_dtype, count=1)
+    with open(path, 'rb') as file:
+        data = bytearray(file.read())
+
+    for name, value in (('version', 2), ('n_types', 3), ('n_elements', 1 << 40), ('rows_offset', len(data))):
+        changed = header.copy()
+        changed[name] = value
+        with open(path, 'wb') as file:
+            file.write(changed.tobytes() + data[changed.itemsize:])
+        with pytest.raises(CircuitFormatError):
+            load(path)